@@ -0,0 +1,131 @@
+# Compare latency and detections of the licence plate and message detectors across inference backends
+# Run from the OCR directory: python -m benchmarks.bench_detectors --images photo1.jpg photo2.png ...
+# Without --images it times random images, which gives latencies but no detections to compare
+import argparse
+import timeit
+import cv2
+import numpy as np
+
+from ocr.yolo import make_blob, filter_detections, YoloDetector
+
+PLATE_MODEL = "./models/license_plate_detector.onnx"
+MESSAGE_WEIGHTS = "./models/message_detector.pt"
+MESSAGE_MODEL = "./models/message_detector.onnx"
+
+
+def xywh_to_xyxy(box):
+    x, y, w, h = box
+    return [x, y, x + w, y + h]
+
+
+# Detections of one image as (box, confidence, class) with [x0, y0, x1, y1] boxes, through the shared
+# pre- and post-processing in ocr/yolo.py
+def yolo_detections(detector, img, confidence_threshold, class_threshold, nms_threshold, with_classes):
+    input_images, blob, factors = make_blob([img])
+    predictions = YoloDetector.forward(detector, blob)
+    result = filter_detections(predictions, factors, confidence_threshold, class_threshold, nms_threshold,
+                               with_classes)[0]
+
+    boxes, confidences, index = result[:3]
+    classes = result[3] if with_classes else [0] * len(boxes)
+    return [(xywh_to_xyxy(boxes[i]), confidences[i], classes[i]) for i in index]
+
+
+def ultralytics_detections(model, img):
+    boxes = model(img, verbose=False)[0].boxes
+    return list(zip(boxes.xyxy.cpu().tolist(), boxes.conf.cpu().tolist(), [int(c) for c in boxes.cls.cpu().tolist()]))
+
+
+def iou(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0
+
+    intersection = width * height
+    return intersection / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection)
+
+
+# Greedily match detections of the same class with IoU >= 0.5 and summarise the differences
+def compare(reference, candidate):
+    matched, ious, confidence_differences = 0, [], []
+    unused = list(candidate)
+
+    for box, confidence, cls in reference:
+        scores = [iou(box, other[0]) if other[2] == cls else 0 for other in unused]
+        if scores and max(scores) >= 0.5:
+            best = int(np.argmax(scores))
+            matched += 1
+            ious.append(scores[best])
+            confidence_differences.append(abs(confidence - unused[best][1]))
+            unused.pop(best)
+
+    return {
+        'matched': matched,
+        'missing': len(reference) - matched,
+        'extra': len(unused),
+        'mean_iou': float(np.mean(ious)) if ious else None,
+        'max_confidence_difference': float(np.max(confidence_differences)) if confidence_differences else None,
+    }
+
+
+def run_backends(name, backends, imgs, repeat):
+    print("\n{}".format(name))
+    outputs = {}
+    for backend, detect in backends.items():
+        detect(imgs[0])  # warm up
+        seconds = min(timeit.repeat(lambda: [detect(img) for img in imgs], number=1, repeat=repeat))
+        outputs[backend] = [detect(img) for img in imgs]
+        print("  {:<12} {:8.1f} ms/image  {} detections".format(backend, seconds * 1000 / len(imgs),
+                                                                   sum(len(output) for output in outputs[backend])))
+
+    reference = list(backends)[0]
+    for backend in list(backends)[1:]:
+        totals = {'matched': 0, 'missing': 0, 'extra': 0}
+        for expected, found in zip(outputs[reference], outputs[backend]):
+            summary = compare(expected, found)
+            for key in totals:
+                totals[key] += summary[key]
+        print("  {} vs {}: {}".format(backend, reference, totals))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--detectors", default="plates,messages")
+    args = parser.parse_args()
+
+    if args.images:
+        imgs = [cv2.imread(path) for path in args.images]
+    else:
+        rng = np.random.default_rng(0)
+        imgs = [rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8) for _ in range(4)]
+
+    threads = (args.intra_op_threads, args.inter_op_threads)
+
+    if "plates" in args.detectors:
+        opencv = YoloDetector(PLATE_MODEL, "opencv")
+        onnxruntime = YoloDetector(PLATE_MODEL, "onnxruntime", *threads)
+        run_backends("licence plates", {
+            'opencv': lambda img: yolo_detections(opencv, img, 0.4, 0.25, 0.45, False),
+            'onnxruntime': lambda img: yolo_detections(onnxruntime, img, 0.4, 0.25, 0.45, False),
+        }, imgs, args.repeat)
+
+    if "messages" in args.detectors:
+        from ultralytics import YOLO
+        from ocr.ocr_messages import export_message_detector
+
+        model = YOLO(MESSAGE_WEIGHTS)
+        export_message_detector(MESSAGE_WEIGHTS)
+        onnxruntime = YoloDetector(MESSAGE_MODEL, "onnxruntime", *threads)
+        run_backends("messages", {
+            'ultralytics': lambda img: ultralytics_detections(model, img),
+            'onnxruntime': lambda img: yolo_detections(onnxruntime, img, 0.25, 0.25, 0.7, True),
+        }, imgs, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+# Offline CPU benchmark of every stage of every engine: pre-processing, classifier, detectors, recognisers and
+# line grouping. Engines whose models or frameworks are not available are skipped and reported as such.
+# Run from the OCR directory:
+#   python -m benchmarks.bench_engines --output results.json
+#   python -m benchmarks.bench_engines --output new.json --compare results.json --threshold 0.2
+# The comparison exits with status 1 if any stage's median time grew by more than its threshold, and any run
+# exits with status 1 if a stage raised
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import cv2
+import numpy as np
+from PIL import Image
+
+import pre_processor
+from engines import EngineRegistry
+from ocr.frame import Frame
+from ocr.layout import reading_order
+from ocr.yolo import make_blob, filter_detections
+from benchmarks.bench_yolo_decode import synthetic_detections
+from benchmarks.synthetic import synthetic_document, synthetic_screenshot, synthetic_plate
+
+
+# Images from a folder (e.g. one under train_model), or the synthetic ones
+def load_images(folder):
+    if folder is None:
+        plate, plate_box = synthetic_plate()
+        return {'document': synthetic_document(), 'screenshot': synthetic_screenshot(), 'plate': plate,
+                'plate_box': plate_box}
+
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder))
+    imgs = [img for img in (cv2.imread(path) for path in paths) if img is not None]
+    if len(imgs) == 0:
+        raise SystemExit("No images found in {}".format(folder))
+
+    # with real images there is no known plate box, so the recogniser reads the middle of the image
+    rows, columns = imgs[0].shape[:2]
+    return {'document': imgs[0], 'screenshot': imgs[len(imgs) // 2], 'plate': imgs[-1],
+            'plate_box': [columns // 4, rows // 3, columns // 2, rows // 3]}
+
+
+# Word boxes of a two column page, in the 4-point format the engines return
+def synthetic_word_boxes(words=400):
+    boxes = []
+    for n in range(words):
+        column, row, word = n % 2, (n // 2) // 5, (n // 2) % 5
+        x, y = 80 + column * 580 + word * 100, 200 + row * 38
+        boxes.append([[x, y], [x + 90, y], [x + 90, y + 28], [x, y + 28]])
+
+    return boxes, ["word{}".format(n) for n in range(words)]
+
+
+def model_free_stages(imgs):
+    document = imgs['document']
+    gray = cv2.cvtColor(document, cv2.COLOR_BGR2GRAY)
+    document_pil = Image.fromarray(document[:, :, ::-1])
+    pipeline = pre_processor.PreProcessingPipeline(["skew_correction", "noise_removal", "thresholding"])
+    boxes, texts = synthetic_word_boxes()
+    detections = synthetic_detections(1)
+
+    return {
+        'frame.decode_pil': lambda: Frame(document_pil).bgr,
+        'pre_processing.estimate_skew': lambda: pre_processor.estimate_skew(gray),
+        'pre_processing.noise_removal': lambda: pre_processor.noise_removal(document),
+        'pre_processing.adaptive_thresholding': lambda: pre_processor.adaptive_thresholding(document),
+        'pre_processing.remove_shadows': lambda: pre_processor.remove_shadows(document_pil),
+        'pre_processing.remove_shadows_fast': lambda: pre_processor.remove_shadows_fast(document_pil),
+        'pre_processing.pipeline': lambda: pipeline.run(document),
+        'layout.reading_order': lambda: reading_order(boxes, texts, split_columns=True),
+        'yolo.make_blob': lambda: make_blob([imgs['plate']]),
+        'yolo.filter_detections': lambda: filter_detections(detections, [2.0]),
+    }
+
+
+def classify_stages(registry, imgs):
+    model_class = registry.model_class("classify")
+    model = model_class(None, None)
+    images = [Image.fromarray(imgs[name][:, :, ::-1]) for name in ("document", "screenshot", "plate")]
+
+    return {
+        'classify.single': lambda: model_class.classify_images(model, images[:1]),
+        'classify.batch_of_3': lambda: model_class.classify_images(model, images),
+    }
+
+
+def car_reg_stages(registry, imgs):
+    model_class = registry.model_class("car_reg")
+    model = model_class()
+    plate = imgs['plate']
+    input_images, detections = model_class.detect_licence_plates_batch(model, [plate])
+    x, y, w, h = imgs['plate_box']
+    crops = [plate[y:y + h, x:x + w]]
+
+    return {
+        'car_reg.detect': lambda: model_class.detect_licence_plates_batch(model, [plate]),
+        'car_reg.filter': lambda: model_class.filter_licence_coords_batch(model, input_images, detections),
+        'car_reg.recognise': lambda: model_class.read_plates(model, crops),
+        'car_reg.get_text': lambda: model_class.get_text(model, plate),
+    }
+
+
+def messages_stages(registry, imgs):
+    model_class = registry.model_class("messages")
+    model = model_class()
+    screenshot = imgs['screenshot']
+    screenshot_pil = Image.fromarray(screenshot[:, :, ::-1])
+    bubble = [30, 150, 480, 250]
+
+    return {
+        'messages.detect': lambda: model_class.detect_messages(model, screenshot),
+        'messages.recognise': lambda: model_class.extract_text(model, screenshot, bubble),
+        'messages.get_text': lambda: model_class.get_text(model, screenshot_pil),
+    }
+
+
+def keras_stages(registry, imgs):
+    model_class = registry.model_class("keras")
+    model = model_class()
+    document = imgs['document'][:, :, ::-1].copy()  # keras_ocr works on RGB
+    box_groups = model.pipeline.detector.detect([document])
+    prediction = model.pipeline.recognize([document])[0]
+
+    return {
+        'keras.detect': lambda: model.pipeline.detector.detect([document]),
+        'keras.recognise': lambda: model.pipeline.recognizer.recognize_from_boxes([document], box_groups),
+        'keras.order': lambda: model_class.order_prediction(prediction),
+        'keras.get_text': lambda: model_class.get_text(model, imgs['document']),
+    }
+
+
+def easyocr_stages(registry, imgs):
+    model_class = registry.model_class("easyocr")
+    model = model_class()
+    reader = model_class.get_reader(model, "English")
+    document = imgs['document']
+    gray = cv2.cvtColor(document, cv2.COLOR_BGR2GRAY)
+    horizontal_list, free_list = reader.detect(document)
+    horizontal_list, free_list = horizontal_list[0], free_list[0]
+
+    return {
+        'easyocr.detect': lambda: reader.detect(document),
+        'easyocr.recognise': lambda: reader.recognize(gray, horizontal_list, free_list),
+        'easyocr.get_text': lambda: model_class.get_text(model, document, "English", False),
+    }
+
+
+def tesseract_stages(registry, imgs):
+    model_class = registry.model_class("tesseract")
+    model = model_class("subprocess")
+    api_model = model_class("api")
+
+    return {
+        'tesseract.get_text': lambda: model_class.get_text(model, imgs['document'], 1),
+        'tesseract.get_text_api': lambda: model_class.get_text(api_model, imgs['document'], 1),
+    }
+
+
+ENGINE_STAGES = {
+    "classify": classify_stages,
+    "car_reg": car_reg_stages,
+    "messages": messages_stages,
+    "keras": keras_stages,
+    "easyocr": easyocr_stages,
+    "tesseract": tesseract_stages,
+}
+
+
+# Median, min and max of repeat runs after one warm-up run, in milliseconds
+def time_stage(function, repeat):
+    function()
+
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start_time) * 1000)
+
+    return {
+        'median_ms': round(statistics.median(times), 3),
+        'min_ms': round(min(times), 3),
+        'max_ms': round(max(times), 3),
+        'runs': repeat,
+    }
+
+
+# Errors that mean an engine cannot run here (its framework or model files are missing) rather than a bug
+UNAVAILABLE = (ImportError, OSError, cv2.error)
+
+
+def run_benchmarks(imgs, engines, repeat, only=None):
+    stages = dict(model_free_stages(imgs))
+    skipped = {}
+    failed = {}
+
+    registry = EngineRegistry()
+    for engine in engines:
+        try:
+            stages.update(ENGINE_STAGES[engine](registry, imgs))
+        except UNAVAILABLE as error:
+            skipped[engine] = "{}: {}".format(type(error).__name__, error)
+
+    results = {}
+    for name, function in stages.items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+
+        print("{:<40}".format(name), end="", flush=True)
+        try:
+            results[name] = time_stage(function, repeat)
+            print("{:10.2f} ms".format(results[name]['median_ms']))
+        except Exception as error:
+            failed[name] = "{}: {}".format(type(error).__name__, error)
+            print("  FAILED ({})".format(failed[name]))
+
+    return {
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'platform': platform.platform(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+        'stages': results,
+        'skipped': skipped,
+        'failed': failed,
+        'import_times': registry.stats()['import_times'],
+    }
+
+
+# Stages whose median time grew by more than their threshold (a fraction, 0.2 = 20% slower)
+def compare(baseline, current, threshold, stage_thresholds=None):
+    stage_thresholds = stage_thresholds or {}
+    regressions = []
+
+    print("\n{:<40}{:>12}{:>12}{:>9}".format("stage", "baseline ms", "current ms", "change"))
+    for name in sorted(set(baseline['stages']) & set(current['stages'])):
+        before = baseline['stages'][name]['median_ms']
+        after = current['stages'][name]['median_ms']
+        change = after / before - 1 if before > 0 else 0
+        limit = stage_thresholds.get(name, threshold)
+
+        flag = ""
+        if change > limit:
+            regressions.append({'stage': name, 'baseline_ms': before, 'current_ms': after, 'change': change,
+                                'threshold': limit})
+            flag = "  REGRESSION"
+        print("{:<40}{:12.2f}{:12.2f}{:+8.0%}{}".format(name, before, after, change, flag))
+
+    for name in sorted(set(baseline['stages']) - set(current['stages'])):
+        print("{:<40}  missing from the current results".format(name))
+
+    return regressions
+
+
+def parse_stage_thresholds(values):
+    thresholds = {}
+    for value in values:
+        name, limit = value.split("=")
+        thresholds[name.strip()] = float(limit)
+
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", help="folder of images to use instead of the synthetic ones")
+    parser.add_argument("--engines", default=",".join(ENGINE_STAGES),
+                        help="comma separated engines to load, e.g. car_reg,easyocr ('' for model-free stages only)")
+    parser.add_argument("--stages", default="", help="comma separated stage name prefixes to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--current", help="compare these saved results instead of running the benchmarks")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    parser.add_argument("--stage-threshold", action="append", default=[],
+                        help="per-stage allowed slowdown, e.g. --stage-threshold keras.detect=0.5")
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current) as f:
+            results = json.load(f)
+    else:
+        engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+        only = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+        results = run_benchmarks(load_images(args.images), engines, args.repeat, only)
+
+        for name, reason in results['skipped'].items():
+            print("skipped {}: {}".format(name, reason))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(baseline, results, args.threshold, parse_stage_thresholds(args.stage_threshold))
+        if regressions:
+            print("\n{} stage(s) regressed".format(len(regressions)))
+            status = 1
+
+    if results.get('failed'):
+        print("\n{} stage(s) failed: {}".format(len(results['failed']), ", ".join(results['failed'])))
+        status = 1
+
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Compare the time and output of remove_shadows and the variants of remove_shadows_fast
+# Run from the OCR directory: python -m benchmarks.bench_shadows --images photo1.jpg photo2.png ...
+# Without --images it uses the synthetic document, whose shadow-free page gives a ground truth for the text:
+# "ink IoU" is the overlap of the Otsu-binarised text with that of the clean page (1 = identical)
+import argparse
+import statistics
+import time
+import cv2
+import numpy as np
+
+import pre_processor
+from benchmarks.synthetic import synthetic_document
+
+VARIANTS = {
+    'full (original)': lambda img: pre_processor.remove_shadows(img),
+    'fast luminance': lambda img: pre_processor.remove_shadows_fast(img, denoise=False),
+    'fast luminance + denoise': lambda img: pre_processor.remove_shadows_fast(img, denoise=True),
+    'fast luminance auto': lambda img: pre_processor.remove_shadows_fast(img),
+    'fast colour': lambda img: pre_processor.remove_shadows_fast(img, colour=True, denoise=False),
+    'fast colour + denoise': lambda img: pre_processor.remove_shadows_fast(img, colour=True, denoise=True),
+}
+
+
+def median_time(function, img, repeat):
+    function(img)
+
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function(img)
+        times.append(time.perf_counter() - start_time)
+
+    return statistics.median(times)
+
+
+def ink(img):
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    return binary.astype(bool)
+
+
+def ink_iou(a, b):
+    a, b = ink(a), ink(b)
+    union = np.logical_or(a, b).sum()
+
+    return np.logical_and(a, b).sum() / union if union else 1.0
+
+
+def psnr(a, b):
+    error = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+
+    return 10 * np.log10(255 ** 2 / error) if error > 0 else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.images:
+        imgs = [(path, cv2.imread(path), None) for path in args.images]
+    else:
+        imgs = [("synthetic document", synthetic_document(), synthetic_document(shadow=False))]
+
+    for name, img, clean in imgs:
+        print("\n{} ({}x{})".format(name, img.shape[1], img.shape[0]))
+        reference = pre_processor.remove_shadows(img)
+        if clean is not None:
+            print("  {:<26}{:>34}  ink IoU vs clean {:.3f}".format("input", "", ink_iou(img, clean)))
+
+        full_time = None
+        for variant, function in VARIANTS.items():
+            seconds = median_time(function, img, args.repeat)
+            full_time = full_time or seconds
+            output = function(img)
+
+            line = "  {:<26}{:9.1f} ms {:6.1f}x  PSNR vs full {:6.1f} dB".format(
+                variant, seconds * 1000, full_time / seconds, psnr(output, reference))
+            if clean is not None:
+                line += "  ink IoU vs clean {:.3f}".format(ink_iou(output, clean))
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Compare latency and text of the Tesseract backends: a tesseract process per request (pytesseract) and the
+# in-process engine pool (tesserocr), sequentially and from several threads at once. With --tiled it also
+# reports the speedup of tiled recognition of one page over a growing process pool against the core count
+# Run from the OCR directory: python -m benchmarks.bench_tesseract --images scan1.png scan2.jpg ...
+# Without --images it reads synthetic documents
+import argparse
+import difflib
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+from ocr.ocr_tesseract import TesseractModel
+from benchmarks.synthetic import synthetic_document
+
+
+def time_sequential(model, imgs, repeat):
+    TesseractModel.get_text(model, imgs[0], 1)  # warm up (loads this thread's engine)
+
+    times = []
+    for _ in range(repeat):
+        for img in imgs:
+            start_time = time.perf_counter()
+            TesseractModel.get_text(model, img, 1)
+            times.append(time.perf_counter() - start_time)
+
+    return times
+
+
+# Images per second with the images spread over a thread pool, as the service's executor does
+def throughput(model, imgs, threads, repeat):
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda img: TesseractModel.get_text(model, img, 1), imgs[:1] * threads))  # warm up
+        start_time = time.perf_counter()
+        list(pool.map(lambda img: TesseractModel.get_text(model, img, 1), imgs * repeat))
+
+        return len(imgs) * repeat / (time.perf_counter() - start_time)
+
+
+def worker_counts():
+    counts = [1]
+    while counts[-1] * 2 < os.cpu_count():
+        counts.append(counts[-1] * 2)
+
+    return counts + [os.cpu_count()] if os.cpu_count() > 1 else counts
+
+
+# Median time of one page read whole and tiled over pools of 1, 2, 4 ... cores
+def tiled_speedup(backend, img, scale, repeat, tessdata_path, language):
+    model = TesseractModel(backend, tessdata_path=tessdata_path, language=language)
+    whole = statistics.median(time_sequential_scaled(model, img, scale, False, repeat))
+    reference = TesseractModel.get_text(model, img, scale)['text']
+
+    print("\ntiled {} at scale {} on {} cores: {:8.1f} ms untiled".format(backend, scale, os.cpu_count(),
+                                                                         whole * 1000))
+    for workers in worker_counts():
+        tiled_model = TesseractModel(backend, tessdata_path=tessdata_path, language=language, tile_workers=workers)
+        seconds = statistics.median(time_sequential_scaled(tiled_model, img, scale, True, repeat))
+        result = TesseractModel.get_text(tiled_model, img, scale, True)
+        similarity = difflib.SequenceMatcher(None, reference, result['text']).ratio()
+        TesseractModel.close(tiled_model)
+
+        print("  {:3d} workers {:3d} tiles {:8.1f} ms  speedup {:5.2f}x  efficiency {:4.0%}  text similarity {:.3f}"
+              .format(workers, result['tiles'], seconds * 1000, whole / seconds, whole / seconds / workers,
+                      similarity))
+
+
+def time_sequential_scaled(model, img, scale, tiled, repeat):
+    TesseractModel.get_text(model, img, scale, tiled)  # warm up (starts the pool and loads its engines)
+
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        TesseractModel.get_text(model, img, scale, tiled)
+        times.append(time.perf_counter() - start_time)
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--tessdata-path")
+    parser.add_argument("--language", default="eng")
+    parser.add_argument("--tiled", action="store_true", help="also time tiled recognition of the first image")
+    parser.add_argument("--scale", type=int, default=2, help="scale for the tiled comparison")
+    args = parser.parse_args()
+
+    if args.images:
+        imgs = [cv2.imread(path) for path in args.images]
+    else:
+        imgs = [synthetic_document(seed) for seed in range(3)]
+
+    models = {
+        'subprocess': TesseractModel("subprocess", tessdata_path=args.tessdata_path, language=args.language),
+        'api': TesseractModel("api", tessdata_path=args.tessdata_path, language=args.language),
+    }
+
+    texts = {}
+    for backend, model in models.items():
+        times = time_sequential(model, imgs, args.repeat)
+        rate = throughput(model, imgs, args.threads, args.repeat)
+        texts[backend] = [TesseractModel.get_text(model, img, 1)['text'] for img in imgs]
+        print("{:<12} median {:8.1f} ms  min {:8.1f} ms  {:6.2f} images/s with {} threads".format(
+            backend, statistics.median(times) * 1000, min(times) * 1000, rate, args.threads))
+
+    similarity = [difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(texts['subprocess'], texts['api'])]
+    print("text similarity api vs subprocess: min {:.3f}  mean {:.3f}".format(min(similarity),
+                                                                              statistics.mean(similarity)))
+
+    result = TesseractModel.get_text(models['api'], imgs[0], 1)
+    print("api: {} words, mean confidence {:.3f}".format(len(result['words']), result['confidence']))
+
+    if args.tiled:
+        for backend in models:
+            tiled_speedup(backend, imgs[0], args.scale, args.repeat, args.tessdata_path, args.language)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Compare the vectorised YOLO decoder with the original per-row loop from ExtractLicencePlatesModel
+# Run from the OCR directory: python -m benchmarks.bench_yolo_decode
+import argparse
+import timeit
+import cv2
+import numpy as np
+
+from ocr.yolo import filter_detections
+
+INPUT_WIDTH = 640
+INPUT_HEIGHT = 640
+
+
+# The original filter_licence_coords loop, kept here as the reference
+def loop_filter_licence_coords(input_image, detections):
+    boxes = []
+    confidences = []
+
+    image_width, image_height = input_image.shape[:2]
+    x_factor = image_width / INPUT_WIDTH
+    y_factor = image_height / INPUT_HEIGHT
+
+    for i in range(len(detections)):
+        rows = detections[i]
+        confidence = rows[4]
+        if confidence > 0.4:
+            class_score = rows[5]
+            if class_score > 0.25:
+                center_x, center_y, width, height = rows[0:4]
+
+                left = int((center_x - 0.5 * width) * x_factor)
+                top = int((center_y - 0.5 * height) * y_factor)
+                width = int(width * x_factor)
+                height = int(height * y_factor)
+                box = np.array([left, top, width, height])
+
+                confidences.append(confidence)
+                boxes.append(box)
+
+    boxes_np = np.array(boxes).tolist()
+    confidences_np = np.array(confidences).tolist()
+
+    index = cv2.dnn.NMSBoxes(boxes_np, confidences_np, 0.25, 0.45)
+    return boxes_np, confidences_np, index
+
+
+# Random YOLO output with a few confident plates among 25,200 candidates
+def synthetic_detections(images, rows=25200, plates=10, seed=0):
+    rng = np.random.default_rng(seed)
+    detections = np.zeros((images, rows, 6), dtype=np.float32)
+    detections[..., 0:2] = rng.uniform(0, INPUT_WIDTH, (images, rows, 2))
+    detections[..., 2:4] = rng.uniform(10, 120, (images, rows, 2))
+    detections[..., 4] = rng.uniform(0, 0.3, (images, rows))
+    detections[..., 5] = rng.uniform(0, 1, (images, rows))
+
+    for image in range(images):
+        confident = rng.choice(rows, plates * 5, replace=False)
+        detections[image, confident, 4] = rng.uniform(0.5, 1, len(confident))
+
+    return detections
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    detections = synthetic_detections(args.images)
+    input_image = np.zeros((1920, 1920, 3), dtype=np.uint8)
+    factor = input_image.shape[0] / INPUT_WIDTH
+
+    # both decoders must keep the same boxes (to a pixel: the loop may round in float32)
+    for image in range(args.images):
+        expected = loop_filter_licence_coords(input_image, detections[image])
+        boxes, confidences, index = filter_detections(detections[image], [factor])[0]
+        assert np.abs(np.array(boxes) - np.array(expected[0])).max(initial=0) <= 1, "boxes differ"
+        assert np.allclose(confidences, expected[1]), "confidences differ"
+        assert sorted(np.array(expected[2]).reshape(-1)) == sorted(index), "NMS result differs"
+
+    loop_time = min(timeit.repeat(lambda: [loop_filter_licence_coords(input_image, d) for d in detections],
+                                  number=1, repeat=args.repeat))
+    single_time = min(timeit.repeat(lambda: [filter_detections(d, [factor]) for d in detections],
+                                    number=1, repeat=args.repeat))
+    batch_time = min(timeit.repeat(lambda: filter_detections(detections, [factor] * args.images),
+                                   number=1, repeat=args.repeat))
+
+    print("images: {}, candidates per image: {}".format(args.images, detections.shape[1]))
+    print("loop:              {:.2f} ms/image".format(loop_time * 1000 / args.images))
+    print("vectorised:        {:.2f} ms/image ({:.0f}x)".format(single_time * 1000 / args.images, loop_time / single_time))
+    print("vectorised batch:  {:.2f} ms/image ({:.0f}x)".format(batch_time * 1000 / args.images, loop_time / batch_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Synthetic document, screenshot and licence plate images for the benchmarks, so they run offline
+import cv2
+import numpy as np
+
+from pre_processor import rotate_image
+
+WORDS = ["the", "invoice", "total", "amount", "payment", "date", "account", "number", "reference", "address",
+         "customer", "order", "delivery", "service", "period", "balance", "please", "contact", "office", "hours"]
+
+
+def random_sentence(rng, words):
+    return " ".join(rng.choice(WORDS, words))
+
+
+# A4 page at 150 dpi with two columns of text, slightly rotated, with a soft shadow across one side
+# (shadow=False for the same page without it)
+def synthetic_document(seed=0, angle=2.0, width=1240, height=1754, shadow=True):
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    cv2.putText(img, "STATEMENT OF ACCOUNT", (80, 120), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 3)
+    for column in range(2):
+        for line in range(40):
+            cv2.putText(img, random_sentence(rng, 4), (80 + column * 580, 200 + line * 38),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2)
+
+    if shadow is True:
+        img = (img * np.linspace(1.0, 0.6, width)[None, :, None]).astype(np.uint8)
+
+    return rotate_image(img, angle)
+
+
+# Phone screenshot of a chat: alternating received (left, grey) and sent (right, green) bubbles
+def synthetic_screenshot(seed=0, width=720, height=1280):
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 245, dtype=np.uint8)
+    cv2.rectangle(img, (0, 0), (width, 110), (94, 128, 7), -1)
+    cv2.putText(img, "Group chat", (30, 70), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
+
+    top = 150
+    for n in range(8):
+        sent = n % 2 == 1
+        left = width - 480 if sent else 30
+        colour = (198, 246, 220) if sent else (255, 255, 255)
+        cv2.rectangle(img, (left, top), (left + 450, top + 100), colour, -1)
+        cv2.putText(img, random_sentence(rng, 3), (left + 20, top + 45), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+        cv2.putText(img, "12:{:02d}".format(n), (left + 370, top + 85), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (120, 120, 120), 1)
+        top += 135
+
+    return img
+
+
+# Car-like scene with a yellow plate. Returns the image and the plate's [left, top, width, height] box
+def synthetic_plate(seed=0, width=1280, height=720, text="AB12 CDE"):
+    rng = np.random.default_rng(seed)
+    img = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+    cv2.rectangle(img, (240, 200), (1040, 620), (40, 40, 150), -1)  # car body
+
+    box = [470, 460, 340, 80]
+    x, y, w, h = box
+    cv2.rectangle(img, (x, y), (x + w, y + h), (0, 210, 250), -1)
+    cv2.putText(img, text, (x + 18, y + 58), cv2.FONT_HERSHEY_SIMPLEX, 1.7, (0, 0, 0), 4)
+
+    return img, box
@@ -0,0 +1,99 @@
+# Compare an optimised classifier backend with the full precision CLIP model on a labelled sample:
+# latency per image, accuracy, and how many /submit_image routing decisions change.
+# The sample is a folder with one sub-folder per category, e.g. sample/vehicle/*.jpg, sample/other/*.png
+# Run from the OCR directory: python -m benchmarks.verify_classifier sample --backend int8
+import argparse
+import json
+import os
+import timeit
+import numpy as np
+from PIL import Image
+
+from classify_image import ClassifyImageModel, quantized_linear_count
+
+
+# (image, expected label, path) for every image in the sample folder
+def load_sample(folder):
+    sample = []
+    for label in sorted(os.listdir(folder)):
+        label_folder = os.path.join(folder, label)
+        if not os.path.isdir(label_folder):
+            continue
+
+        for name in sorted(os.listdir(label_folder)):
+            try:
+                image = Image.open(os.path.join(label_folder, name)).convert("RGB")
+            except OSError:
+                continue
+            sample.append((image, label, os.path.join(label, name)))
+
+    return sample
+
+
+def run(model, images, batch_size, repeat):
+    def classify_all():
+        probs, labels = [], []
+        for start in range(0, len(images), batch_size):
+            batch_probs, batch_labels = ClassifyImageModel.classify_images(model, images[start:start + batch_size])
+            probs.append(batch_probs)
+            labels += batch_labels
+        return np.concatenate(probs), labels
+
+    classify_all()  # warm up
+    seconds = min(timeit.repeat(classify_all, number=1, repeat=repeat))
+    probs, labels = classify_all()
+
+    return probs, labels, seconds * 1000 / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sample")
+    parser.add_argument("--backend", default="int8", choices=["int8", "onnx"])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--labels", default="vehicle,document,sms")
+    args = parser.parse_args()
+
+    sample = load_sample(args.sample)
+    if len(sample) == 0:
+        raise SystemExit("No images found in {}".format(args.sample))
+    images = [image for image, label, path in sample]
+    expected = [label for image, label, path in sample]
+
+    labels = args.labels.split(",")
+    reference = ClassifyImageModel(None, None, labels, args.threshold)
+    reference_probs, reference_labels, reference_ms = run(reference, images, args.batch_size, args.repeat)
+
+    # load a fresh fp32 model for the candidate, int8 quantisation changes the model in place
+    candidate = ClassifyImageModel(None, None, labels, args.threshold, backend=args.backend)
+    if args.backend == "int8":
+        quantized = quantized_linear_count(candidate.model)
+        projection = type(candidate.model.visual_projection).__name__
+        print("int8: {} quantised Linear layers, visual_projection is {}".format(quantized, projection))
+        if quantized == 0 or projection == "Linear":
+            raise SystemExit("int8 backend did not quantise the image tower")
+    candidate_probs, candidate_labels, candidate_ms = run(candidate, images, args.batch_size, args.repeat)
+
+    changed = [{'image': path, 'fp32': before, args.backend: after}
+               for (image, label, path), before, after in zip(sample, reference_labels, candidate_labels)
+               if before != after]
+
+    report = {
+        'images': len(sample),
+        'backend': args.backend,
+        'fp32_ms_per_image': round(reference_ms, 2),
+        'candidate_ms_per_image': round(candidate_ms, 2),
+        'speedup': round(reference_ms / candidate_ms, 2),
+        'fp32_accuracy': float(np.mean([a == b for a, b in zip(reference_labels, expected)])),
+        'candidate_accuracy': float(np.mean([a == b for a, b in zip(candidate_labels, expected)])),
+        'changed_routing_decisions': len(changed),
+        'max_probability_difference': float(np.abs(reference_probs - candidate_probs).max()),
+        'changed': changed,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
+import os
 from PIL import Image
 from pydantic import BaseModel
 from transformers import CLIPProcessor, CLIPModel
+import torch
+from ocr.frame import Frame
 
 
 class ClassifyImage(BaseModel):
@@ -10,11 +13,40 @@ class ClassifyImage(BaseModel):
     detection_time: float
 
 
-class ClassifyImageModel:
-    def __init__(self, model, processor):
-        self.labels = ["vehicle", "document", "sms"]  # 3 possible categories + other
-        self.threshold = 0.6  # threshold = 75% -> any image with a confidence below this for all 3 categories is "other"
+# Number of Linear layers of the model replaced by dynamically quantised ones
+def quantized_linear_count(model):
+    return sum(isinstance(module, torch.nn.quantized.dynamic.Linear) for module in model.modules())
+
+
+# The CLIP image tower on its own, so it can be exported to ONNX
+class ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+# Export the image tower with a dynamic batch size. Writes ./models/image_classifier_vision.onnx by default
+def export_image_tower(model, path="./models/image_classifier_vision.onnx"):
+    image_size = model.config.vision_config.image_size
+    pixel_values = torch.zeros((1, 3, image_size, image_size))
+
+    with torch.inference_mode():
+        torch.onnx.export(ImageTower(model).eval(), (pixel_values,), path, input_names=["pixel_values"],
+                          output_names=["image_embeds"], opset_version=14,
+                          dynamic_axes={'pixel_values': {0: "batch"}, 'image_embeds': {0: "batch"}})
+
+    return path
 
+
+class ClassifyImageModel:
+    # backend is how the image tower runs on the CPU: "fp32" (the original model), "int8" (dynamic INT8
+    # quantisation of its linear layers) or "onnx" (exported and run with ONNX Runtime). The label
+    # embeddings always come from the full precision text tower
+    def __init__(self, model, processor, labels=None, threshold=0.6, backend="fp32",
+                 onnx_path="./models/image_classifier_vision.onnx"):
         # load pre-trained saved models
         if model is None:
             self.model = CLIPModel.from_pretrained("./models/image_classifier_model")
@@ -24,30 +56,87 @@ class ClassifyImageModel:
             self.model = model
             self.processor = processor
 
+        self.model.eval()
+
+        self.labels = labels or ["vehicle", "document", "sms"]  # 3 possible categories + other
+        self.threshold = threshold  # any image with a confidence below this for all categories is "other"
+
+        self.backend = backend
+        self.session = None
+        if backend == "int8":
+            # quantised through the parent model: quantize_dynamic only swaps child modules, so called on the bare
+            # visual_projection Linear it would return it unchanged. The text tower stays fp32
+            qconfig = torch.quantization.default_dynamic_qconfig
+            torch.quantization.quantize_dynamic(self.model, {'vision_model': qconfig, 'visual_projection': qconfig},
+                                                inplace=True)
+
+        elif backend == "onnx":
+            import onnxruntime
+
+            if not os.path.exists(onnx_path):
+                export_image_tower(self.model, onnx_path)
+
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+        elif backend != "fp32":
+            raise ValueError("Unknown classifier backend: {}".format(backend))
+
+    # Changing the labels re-computes their text embeddings
+    @property
+    def labels(self):
+        return self._labels
+
+    @labels.setter
+    def labels(self, labels):
+        self._labels = list(labels)
+        self.text_embeds = ClassifyImageModel.embed_labels(self, self._labels)
+
+    # Run the label prompts through the text tower once and keep the normalised embeddings
+    def embed_labels(self, labels):
+        inputs = self.processor(text=labels, return_tensors="pt", padding=True)
+
+        with torch.inference_mode():
+            text_embeds = self.model.get_text_features(input_ids=inputs["input_ids"],
+                                                       attention_mask=inputs["attention_mask"])
+
+        return text_embeds / text_embeds.norm(dim=-1, keepdim=True)
+
+    # Label confidences for many images in one forward pass of the image tower only.
+    # Returns an (images x labels) array of probabilities and the label of each image
+    def classify_images(self, images):
+        images = [Frame.of(image).pil for image in images]
+        inputs = self.processor(images=images, return_tensors="pt")
+
+        with torch.inference_mode():
+            if self.session is not None:
+                image_embeds = torch.from_numpy(
+                    self.session.run(None, {'pixel_values': inputs["pixel_values"].numpy()})[0])
+            else:
+                image_embeds = self.model.get_image_features(pixel_values=inputs["pixel_values"])
+            image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
+
+            # same logits as CLIPModel.forward, using the cached label embeddings
+            logits_per_image = self.model.logit_scale.exp() * image_embeds @ self.text_embeds.t()
+            probs = logits_per_image.softmax(dim=-1).numpy()
+
+        labels = [ClassifyImageModel.label_for(self, image_probs) for image_probs in probs]
+
+        return probs, labels
+
+    # if the label confidence is above the threshold it is that label, otherwise "other"
+    def label_for(self, probs):
+        best = int(probs.argmax())
+        if probs[best] > self.threshold:
+            return self.labels[best]
+
+        return "other"
+
     # work out which category the image fits into
     def classify_image(self, image):
-        # image = Image.open(image_file_path)
-        inputs = self.processor(text=self.labels, images=image, return_tensors="pt", padding=True)
-        output = self.model(**inputs)
-
-        # get the confidence scores from the output
-        logits_per_image = output.logits_per_image
-        probs = logits_per_image.softmax(dim=-1).detach().numpy()[0]
-        print(probs)
-        count = 0
-        found = False
-        for i in probs:
-            if i > self.threshold:  # if the label confidence is above the threshold(80%), it is that label
-                label = self.labels[count]
-                print("File name:", "image_file_path")
-                print("Label:", self.labels[count])
-                found = True
-            count = count + 1
-
-        # if image doesn't fit into any category
-        if found is False:
-            label = "other"
-            print("File name:", "image_file_path")
-            print("Label: Other")
-
-        return label
+        probs, labels = ClassifyImageModel.classify_images(self, [image])
+        print(probs[0])
+        print("Label:", labels[0])
+
+        return labels[0]
@@ -0,0 +1,66 @@
+# Multi-page documents (PDF, multi-page TIFF, or any single image) read one page at a time, so only the pages
+# being worked on are ever rasterised and held in memory
+import io
+import threading
+from PIL import Image
+
+# PDFium is not thread-safe, even across documents, so all PDF work in the process goes through one lock
+pdfium_lock = threading.Lock()
+
+
+# Raised for uploads that are neither a PDF nor an image PIL can read
+class UnsupportedDocument(Exception):
+    pass
+
+
+class Document:
+    # dpi is the resolution PDF pages are rasterised at; images keep their own resolution
+    def __init__(self, contents, dpi=200):
+        self.dpi = dpi
+        self.pdf = None
+        self.image = None
+
+        if contents[:5] == b"%PDF-":
+            import pypdfium2
+
+            try:
+                with pdfium_lock:
+                    self.pdf = pypdfium2.PdfDocument(contents)
+                    self.page_count = len(self.pdf)
+            except pypdfium2.PdfiumError as error:
+                raise UnsupportedDocument("Cannot read the PDF: {}".format(error))
+        else:
+            try:
+                self.image = Image.open(io.BytesIO(contents))
+            except Exception:
+                raise UnsupportedDocument("Upload is not a PDF or an image")
+            self.image_lock = threading.Lock()
+            self.page_count = getattr(self.image, "n_frames", 1)
+
+    def __len__(self):
+        return self.page_count
+
+    # Page number (from 1) as an RGB PIL image
+    def page(self, number):
+        if not 1 <= number <= self.page_count:
+            raise IndexError("Page {} is out of range 1-{}".format(number, self.page_count))
+
+        if self.pdf is not None:
+            with pdfium_lock:
+                page = self.pdf[number - 1]
+                try:
+                    return page.render(scale=self.dpi / 72).to_pil().convert("RGB")
+                finally:
+                    page.close()
+
+        # a multi-page image has one current frame, so pages are read one at a time
+        with self.image_lock:
+            self.image.seek(number - 1)
+            return self.image.convert("RGB")
+
+    def close(self):
+        if self.pdf is not None:
+            with pdfium_lock:
+                self.pdf.close()
+        if self.image is not None:
+            self.image.close()
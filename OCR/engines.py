@@ -0,0 +1,63 @@
+import importlib
+import threading
+from time import perf_counter
+
+
+# Module and model class of each engine. The modules pull in the heavy frameworks (TensorFlow, torch,
+# transformers, easyocr...), so they are only imported when the engine is first used
+ENGINE_MODULES = {
+    "classify": ("classify_image", "ClassifyImageModel"),
+    "keras": ("ocr.ocr_keras", "KerasModel"),
+    "tesseract": ("ocr.ocr_tesseract", "TesseractModel"),
+    "easyocr": ("ocr.ocr_easyocr", "EasyOCRModel"),
+    "car_reg": ("ocr.ocr_cars", "ExtractLicencePlatesModel"),
+    "messages": ("ocr.ocr_messages", "ExtractMessagesModel"),
+}
+
+
+# Raised when a request needs an engine that this deployment has not enabled
+class EngineDisabled(Exception):
+    def __init__(self, name):
+        super().__init__("The {} engine is not enabled".format(name))
+        self.name = name
+
+
+# Imports the engine modules on demand and records how long each import took.
+# A framework shared by two engines (e.g. torch) is counted against whichever engine imported it first
+class EngineRegistry:
+    def __init__(self, enabled=None):
+        enabled = list(ENGINE_MODULES) if enabled is None else list(enabled)
+        unknown = set(enabled) - set(ENGINE_MODULES)
+        if unknown:
+            raise ValueError("Unknown engines: {}".format(", ".join(sorted(unknown))))
+
+        self.enabled = [name for name in ENGINE_MODULES if name in enabled]
+        self.modules = {}
+        self.import_times = {}
+        self.lock = threading.Lock()
+
+    def is_enabled(self, name):
+        return name in self.enabled
+
+    def module(self, name):
+        if name not in self.enabled:
+            raise EngineDisabled(name)
+
+        if name not in self.modules:
+            with self.lock:
+                if name not in self.modules:
+                    start_time = perf_counter()
+                    self.modules[name] = importlib.import_module(ENGINE_MODULES[name][0])
+                    self.import_times[name] = perf_counter() - start_time
+
+        return self.modules[name]
+
+    def model_class(self, name):
+        return getattr(EngineRegistry.module(self, name), ENGINE_MODULES[name][1])
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'imported': sorted(self.modules),
+            'import_times': dict(self.import_times),
+        }
@@ -0,0 +1,103 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from time import perf_counter
+
+
+# Raised when a model's queue is full (429) or the service as a whole is saturated (503)
+class Overloaded(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+# Runs blocking inference in a worker pool so the event loop stays free for other requests.
+# Each model has its own concurrency limit and queue depth; requests beyond those are rejected straight away.
+# Worker processes are started with start_method ("forkserver" or "spawn") rather than forked from the server,
+# whose threads may hold locks that the child would inherit in their held state
+class InferenceExecutor:
+    def __init__(self, max_workers=4, kind="thread", concurrency=None, max_queue=8, max_pending=32,
+                 start_method="forkserver"):
+        if kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=multiprocessing.get_context(start_method))
+        elif kind == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        else:
+            raise ValueError("Unknown executor kind: {}".format(kind))
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self.concurrency = concurrency or {}  # model name -> jobs allowed to run at once, default 1
+        self.max_queue = max_queue  # jobs allowed to wait per model
+        self.max_pending = max_pending  # jobs allowed to wait across all models
+        self.semaphores = {}
+        self.waiting = {}
+        self.running = {}
+        self.rejected = {'429': 0, '503': 0}
+
+    def semaphore(self, model):
+        if model not in self.semaphores:
+            self.semaphores[model] = asyncio.Semaphore(self.concurrency.get(model, 1))
+            self.waiting[model] = 0
+            self.running[model] = 0
+
+        return self.semaphores[model]
+
+    # Run function(*args, **kwargs) for model in the pool.
+    # Returns the result and the time spent waiting for a slot and computing
+    async def run(self, model, function, *args, **kwargs):
+        semaphore = self.semaphore(model)
+
+        if self.waiting[model] >= self.max_queue:
+            self.rejected['429'] += 1
+            raise Overloaded(429, "Too many queued requests for {}".format(model))
+
+        if sum(self.waiting.values()) >= self.max_pending:
+            self.rejected['503'] += 1
+            raise Overloaded(503, "Service is saturated, try again later")
+
+        queued_at = perf_counter()
+        self.waiting[model] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting[model] -= 1
+
+        started_at = perf_counter()
+        self.running[model] += 1
+        try:
+            call = functools.partial(function, *args, **kwargs)
+            if self.kind == "thread":
+                # run in a copy of the request's context so stage timings recorded in the worker reach the request
+                call = functools.partial(contextvars.copy_context().run, call)
+
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, call)
+        finally:
+            self.running[model] -= 1
+            semaphore.release()
+
+        timings = {
+            'queue_time': started_at - queued_at,
+            'compute_time': perf_counter() - started_at,
+        }
+        return result, timings
+
+    def stats(self):
+        return {
+            'kind': self.kind,
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'max_pending': self.max_pending,
+            'waiting': dict(self.waiting),
+            'running': dict(self.running),
+            'concurrency': {model: self.concurrency.get(model, 1) for model in self.semaphores},
+            'rejected': dict(self.rejected),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
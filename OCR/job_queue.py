@@ -0,0 +1,176 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# JSON that also takes NumPy scalars
+def to_json(value):
+    return json.dumps(value, default=lambda item: item.item() if hasattr(item, "item") else str(item))
+
+
+# Persistent queue of OCR jobs in a local SQLite database, so queued work survives restarts.
+# Higher priority jobs run first, then the oldest. Finished jobs are kept for retention seconds,
+# and at most max_finished of them are kept
+class JobQueue:
+    def __init__(self, path="jobs.db", retention=24 * 3600, max_finished=1000):
+        self.path = path
+        self.retention = retention
+        self.max_finished = max_finished
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                params TEXT NOT NULL,
+                contents BLOB,
+                source_file TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+
+    # Put jobs that were running when the service stopped back in the queue. Only call this from the process
+    # that runs the jobs, once at startup: worker processes that import the service must not requeue them
+    def recover_running(self):
+        with self.lock:
+            return self.connection.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'").rowcount
+
+    def submit(self, endpoint, params, contents, source_file, priority=0):
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO jobs (id, endpoint, params, contents, source_file, priority, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, endpoint, to_json(params), contents, source_file, priority, time.time()))
+
+        return job_id
+
+    # Take the next queued job and mark it running. Returns None if the queue is empty
+    def claim(self):
+        with self.lock:
+            while True:
+                row = self.connection.execute(
+                    "SELECT id, endpoint, params, contents, source_file FROM jobs WHERE status = 'queued' "
+                    "ORDER BY priority DESC, created_at LIMIT 1").fetchone()
+                if row is None:
+                    return None
+
+                # another process may have claimed it first
+                claimed = self.connection.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued'",
+                    (time.time(), row["id"])).rowcount
+                if claimed == 1:
+                    return {
+                        'id': row["id"],
+                        'endpoint': row["endpoint"],
+                        'params': json.loads(row["params"]),
+                        'contents': row["contents"],
+                        'source_file': row["source_file"],
+                    }
+
+    def complete(self, job_id, result):
+        self.finish(job_id, "done", result=to_json(result))
+
+    def fail(self, job_id, error):
+        self.finish(job_id, "failed", error=str(error))
+
+    # Put a claimed job back, e.g. when the workers are saturated
+    def requeue(self, job_id):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = CASE WHEN cancel_requested = 1 THEN 'cancelled' ELSE 'queued' END, "
+                "started_at = NULL WHERE id = ?", (job_id,))
+
+    # Results of a job that was cancelled while running are thrown away. The upload is dropped once finished
+    def finish(self, job_id, status, result=None, error=None):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = CASE WHEN cancel_requested = 1 THEN 'cancelled' ELSE ? END, "
+                "result = CASE WHEN cancel_requested = 1 THEN NULL ELSE ? END, "
+                "error = ?, contents = NULL, finished_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id))
+
+    # Queued jobs are cancelled straight away, running jobs once they finish. Returns the new status
+    def cancel(self, job_id):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = 'cancelled', contents = NULL, finished_at = ? "
+                "WHERE id = ? AND status = 'queued'", (time.time(), job_id))
+            self.connection.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+
+        job = self.get(job_id)
+        return None if job is None else job["status"]
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, endpoint, source_file, priority, status, cancel_requested, result, error, created_at, "
+                "started_at, finished_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = {
+            'job_id': row["id"],
+            'endpoint': row["endpoint"],
+            'source_file': row["source_file"],
+            'priority': row["priority"],
+            'status': "cancelling" if row["status"] == "running" and row["cancel_requested"] else row["status"],
+            'created_at': row["created_at"],
+            'queue_time': None,
+            'run_time': None,
+        }
+        if row["started_at"] is not None:
+            job["queue_time"] = row["started_at"] - row["created_at"]
+            if row["finished_at"] is not None:
+                job["run_time"] = row["finished_at"] - row["started_at"]
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+
+        return job
+
+    # Remove finished jobs past the retention time, then the oldest beyond max_finished
+    def cleanup(self):
+        with self.lock:
+            finished = "status IN ('done', 'failed', 'cancelled')"
+            self.connection.execute("DELETE FROM jobs WHERE {} AND finished_at < ?".format(finished),
+                                    (time.time() - self.retention,))
+            self.connection.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE {} ORDER BY finished_at DESC LIMIT -1 OFFSET ?)"
+                .format(finished), (self.max_finished,))
+
+    # Queue depth and timings for monitoring
+    def stats(self):
+        with self.lock:
+            counts = dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            queued_by_priority = dict(self.connection.execute(
+                "SELECT priority, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY priority").fetchall())
+            oldest = self.connection.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            timings = self.connection.execute(
+                "SELECT AVG(started_at - created_at), AVG(finished_at - started_at), MAX(finished_at - started_at) "
+                "FROM jobs WHERE status = 'done'").fetchone()
+
+        return {
+            'counts': counts,
+            'queue_depth': counts.get("queued", 0),
+            'queued_by_priority': queued_by_priority,
+            'oldest_queued_age': None if oldest is None else time.time() - oldest,
+            'average_queue_time': timings[0],
+            'average_run_time': timings[1],
+            'max_run_time': timings[2],
+        }
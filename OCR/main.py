@@ -1,16 +1,32 @@
-from fastapi import UploadFile, File, Response
+from fastapi import UploadFile, File, Response, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.routing import Match
+from typing import List
+from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_offline import FastAPIOffline
 from PIL import Image
+import asyncio
 import io
+import os
+import zipfile
+import tempfile
+import threading
+import uuid
+import cv2
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
-import plotly.express as px
-from ocr.ocr_messages import ExtractMessagesModel
-from ocr.ocr_keras import KerasModel
-from ocr.ocr_tesseract import TesseractModel
-from ocr.ocr_easyocr import EasyOCRModel
-from ocr.ocr_cars import ExtractLicencePlatesModel
-from classify_image import ClassifyImageModel
+from engines import EngineRegistry, EngineDisabled
+from inference_executor import InferenceExecutor, Overloaded
+from result_cache import ResultCache, cache_key
+from job_queue import JobQueue, to_json
+from documents import Document, UnsupportedDocument
+from metrics import MetricsRegistry
+from ocr.timing import start_timings, stage, add_stage, current_timings
+from ocr.frame import Frame
 import pre_processor
 
 app = FastAPIOffline()
@@ -29,45 +45,683 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"])
 
-# global models so that they only get loaded once
-keras_model = None
-tesseract_model = None
-easyocr_model = None
-car_reg_model = None
-classify_model = None
-processor_model = None
-message_model = None
+# Prometheus metrics, served at /metrics
+metrics = MetricsRegistry()
+request_latency = metrics.histogram("ocr_request_duration_seconds", "Request latency", ["endpoint"])
+stage_latency = metrics.histogram("ocr_stage_duration_seconds", "Time spent in each stage of a request",
+                                  ["endpoint", "stage"])
+requests_total = metrics.counter("ocr_requests_total", "Requests by response status", ["endpoint", "status"])
+requests_in_flight = metrics.gauge("ocr_requests_in_flight", "Requests being handled", ["endpoint"])
+model_loads = metrics.counter("ocr_model_loads_total", "Model loads", ["model", "status"])
+model_load_time = metrics.gauge("ocr_model_load_seconds", "Time the last load of each model took", ["model"])
+inference_waiting = metrics.gauge("ocr_inference_waiting", "Inference jobs waiting for a worker", ["model"])
+inference_running = metrics.gauge("ocr_inference_running", "Inference jobs running", ["model"])
+
+
+# Route template of a request (e.g. /jobs/{job_id}), so each endpoint is one set of series
+def route_path(scope):
+    for route in app.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+
+    return "unmatched"
+
+
+def observe_stages(endpoint, timings):
+    for name, seconds in timings.items():
+        stage_latency.observe(seconds, endpoint=endpoint, stage=name)
+
+
+# Latency, status and in-flight count of every request, and the time spent in each stage of it
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    endpoint = route_path(request.scope)
+    timings = start_timings()
+    requests_in_flight.inc(endpoint=endpoint)
+    start_time = perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        requests_in_flight.dec(endpoint=endpoint)
+        request_latency.observe(perf_counter() - start_time, endpoint=endpoint)
+        requests_total.inc(endpoint=endpoint, status=status)
+        observe_stages(endpoint, timings)
+
+
+# Engines this deployment serves, e.g. ENABLED_ENGINES="car_reg" ("all" by default). The frameworks behind an
+# engine are only imported once it is used, and the endpoints of disabled engines return 404
+ENABLED_ENGINES = os.environ.get("ENABLED_ENGINES", "all")
+engine_registry = EngineRegistry(None if ENABLED_ENGINES.strip() == "all" else
+                                 [name.strip() for name in ENABLED_ENGINES.split(",") if name.strip()])
+
+
+def engine_class(name):
+    return engine_registry.model_class(name)
+
+
+@app.exception_handler(EngineDisabled)
+async def engine_disabled_handler(request: Request, error: EngineDisabled):
+    return JSONResponse(status_code=404, content={'detail': str(error)})
+
+
+# EasyOCR reader pool settings, e.g. EASYOCR_PRELOAD_LANGUAGES="English,French"
+EASYOCR_MAX_READERS = int(os.environ.get("EASYOCR_MAX_READERS", 4))
+EASYOCR_MAX_MEMORY_MB = float(os.environ["EASYOCR_MAX_MEMORY_MB"]) if "EASYOCR_MAX_MEMORY_MB" in os.environ else None
+EASYOCR_PRELOAD_LANGUAGES = [language.strip() for language in os.environ.get("EASYOCR_PRELOAD_LANGUAGES", "").split(",")
+                             if language.strip()]
+
+
+def load_easyocr_model():
+    return engine_class("easyocr")(EASYOCR_MAX_READERS, EASYOCR_MAX_MEMORY_MB, EASYOCR_PRELOAD_LANGUAGES)
+
+
+# Image categories for /submit_image, e.g. CLASSIFY_LABELS="vehicle,document,sms"
+CLASSIFY_LABELS = [label.strip() for label in os.environ.get("CLASSIFY_LABELS", "vehicle,document,sms").split(",")
+                   if label.strip()]
+CLASSIFY_THRESHOLD = float(os.environ.get("CLASSIFY_THRESHOLD", 0.6))
+CLASSIFY_BACKEND = os.environ.get("CLASSIFY_BACKEND", "fp32")  # "fp32", "int8" or "onnx"
+
+
+def load_classify_model():
+    return engine_class("classify")(model=None, processor=None, labels=CLASSIFY_LABELS, threshold=CLASSIFY_THRESHOLD,
+                                     backend=CLASSIFY_BACKEND)
+
+
+# Detector backends: PLATE_DETECTOR_BACKEND is "opencv" or "onnxruntime", MESSAGE_DETECTOR_BACKEND is
+# "ultralytics", "onnxruntime" or "opencv". ONNX Runtime threads default to 0 (one per core)
+PLATE_DETECTOR_BACKEND = os.environ.get("PLATE_DETECTOR_BACKEND", "opencv")
+MESSAGE_DETECTOR_BACKEND = os.environ.get("MESSAGE_DETECTOR_BACKEND", "ultralytics")
+DETECTOR_INTRA_OP_THREADS = int(os.environ.get("DETECTOR_INTRA_OP_THREADS", 0))
+DETECTOR_INTER_OP_THREADS = int(os.environ.get("DETECTOR_INTER_OP_THREADS", 0))
+
+
+def load_car_reg_model():
+    return engine_class("car_reg")(PLATE_DETECTOR_BACKEND, DETECTOR_INTRA_OP_THREADS, DETECTOR_INTER_OP_THREADS)
+
+
+def load_messages_model():
+    return engine_class("messages")(MESSAGE_DETECTOR_BACKEND, DETECTOR_INTRA_OP_THREADS, DETECTOR_INTER_OP_THREADS)
+
+
+# TESSERACT_BACKEND is "api" (one in-process engine per worker thread, with word boxes and confidences) or
+# "subprocess" (a tesseract process per request). TESSDATA_PATH defaults to the one tesseract was built with
+TESSERACT_BACKEND = os.environ.get("TESSERACT_BACKEND", "api")
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", "tesseract")
+TESSDATA_PATH = os.environ.get("TESSDATA_PATH") or None
+TESSERACT_LANGUAGE = os.environ.get("TESSERACT_LANGUAGE", "eng")
+# Processes for /tesseract?tiled=true, which reads the bands of a page in parallel (default one per core)
+TESSERACT_TILE_WORKERS = int(os.environ.get("TESSERACT_TILE_WORKERS", 0)) or None
+
+
+def load_tesseract_model():
+    return engine_class("tesseract")(TESSERACT_BACKEND, TESSERACT_CMD, TESSDATA_PATH, TESSERACT_LANGUAGE,
+                                     TESSERACT_TILE_WORKERS)
+
+
+# global models so that they only get loaded once (once per worker process with INFERENCE_EXECUTOR=process)
+MODEL_LOADERS = {
+    "classify": load_classify_model,
+    "keras": lambda: engine_class("keras")(),
+    "tesseract": load_tesseract_model,
+    "easyocr": load_easyocr_model,
+    "car_reg": load_car_reg_model,
+    "messages": load_messages_model,
+}
+models = {}
+model_locks = {name: threading.Lock() for name in MODEL_LOADERS}
+model_status = {}  # model name -> load state, load and warm-up times and memory
+
+
+# Resident memory of this process in MB (Linux only, None elsewhere)
+def process_memory_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_model(name):
+    if not engine_registry.is_enabled(name):
+        raise EngineDisabled(name)
+
+    if name not in models:
+        with model_locks[name]:
+            if name not in models:
+                model_status[name] = {'status': "loading"}
+                memory_before = process_memory_mb()
+                start_time = perf_counter()
+                try:
+                    model = MODEL_LOADERS[name]()
+                except Exception as error:
+                    model_status[name] = {'status': "failed", 'error': str(error)}
+                    model_loads.inc(model=name, status="failed")
+                    raise
+
+                memory_after = process_memory_mb()
+                model_status[name] = {
+                    'status': "loaded",
+                    'load_time': perf_counter() - start_time,
+                    'memory_mb': None if memory_before is None else round(memory_after - memory_before, 1),
+                }
+                models[name] = model
+                model_loads.inc(model=name, status="loaded")
+                model_load_time.set(model_status[name]["load_time"], model=name)
+
+    return models[name]
+
+
+# Small synthetic image with some text on it, run through each model once after loading
+def warmup_image():
+    img = np.full((160, 480, 3), 255, dtype=np.uint8)
+    cv2.putText(img, "AB12 CDE", (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 4)
+
+    return img
+
+
+WARMUPS = {
+    "classify": lambda model, img: engine_class("classify").classify_images(model, [Frame(img)]),
+    "keras": lambda model, img: engine_class("keras").get_text(model, img),
+    "tesseract": lambda model, img: engine_class("tesseract").get_text(model, img, 1),
+    "easyocr": lambda model, img: engine_class("easyocr").get_text(model, img, "English", False),
+    "car_reg": lambda model, img: engine_class("car_reg").get_text(model, img),
+    "messages": lambda model, img: engine_class("messages").get_text(model, Frame(img)),
+}
+
+
+# Load a model and run one inference on it, so graph building and kernel selection happen before the first request
+def load_and_warm_up(name):
+    model = get_model(name)
+    if model_status[name]["status"] == "ready":
+        return
+
+    start_time = perf_counter()
+    try:
+        WARMUPS[name](model, warmup_image())
+    except Exception as error:
+        model_status[name].update({'status': "failed", 'error': "warm-up failed: {}".format(error)})
+        return
+
+    model_status[name].update({'status': "ready", 'warmup_time': perf_counter() - start_time})
+
+
+# Models to load when the service starts, e.g. PRELOAD_MODELS="classify,car_reg" ("all" by default, "" for none).
+# They load in parallel, PRELOAD_WORKERS at a time. With PRELOAD_WORKERS=1 the memory figure of each model
+# is exact, otherwise it also counts whatever the other models allocated at the same time
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "all")
+PRELOAD_MODELS = list(engine_registry.enabled) if PRELOAD_MODELS.strip() == "all" else \
+    [name.strip() for name in PRELOAD_MODELS.split(",") if name.strip()]
+PRELOAD_WORKERS = int(os.environ.get("PRELOAD_WORKERS", len(MODEL_LOADERS)))
+
+unknown_models = set(PRELOAD_MODELS) - set(engine_registry.enabled)
+if unknown_models:
+    raise ValueError("Models in PRELOAD_MODELS that are not enabled: {}".format(", ".join(sorted(unknown_models))))
+
+
+async def preload_models(names):
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max(1, PRELOAD_WORKERS), thread_name_prefix="preload") as pool:
+        await asyncio.gather(*(loop.run_in_executor(pool, load_and_warm_up, name) for name in names),
+                             return_exceptions=True)
+
+
+# Worker pool for inference, e.g. INFERENCE_CONCURRENCY="keras=1,easyocr=2" (default 1 request per model at a time)
+def parse_concurrency(value):
+    concurrency = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, limit = item.split("=")
+            concurrency[name.strip()] = int(limit)
+
+    return concurrency
+
+
+executor = InferenceExecutor(max_workers=int(os.environ.get("INFERENCE_WORKERS", 4)),
+                             kind=os.environ.get("INFERENCE_EXECUTOR", "thread"),
+                             concurrency=parse_concurrency(os.environ.get("INFERENCE_CONCURRENCY", "")),
+                             max_queue=int(os.environ.get("INFERENCE_MAX_QUEUE", 8)),
+                             max_pending=int(os.environ.get("INFERENCE_MAX_PENDING", 32)),
+                             start_method=os.environ.get("INFERENCE_START_METHOD", "forkserver"))
+
+
+# Reject requests straight away when the service is saturated
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, error: Overloaded):
+    return JSONResponse(status_code=error.status_code, content={'detail': error.detail})
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    executor.shutdown()
+    if "tesseract" in models:
+        engine_class("tesseract").close(models["tesseract"])
+
+
+# Results keyed by the uploaded bytes and request parameters, e.g. RESULT_CACHE_DIR="./cache" to keep them on disk
+result_cache = ResultCache(max_entries=int(os.environ.get("RESULT_CACHE_SIZE", 256)),
+                           ttl=float(os.environ.get("RESULT_CACHE_TTL", 3600)),
+                           directory=os.environ.get("RESULT_CACHE_DIR"),
+                           disk_max_mb=float(os.environ.get("RESULT_CACHE_DISK_MB", 512)),
+                           disk_ttl=float(os.environ.get("RESULT_CACHE_DISK_TTL", 7 * 24 * 3600)))
+
+
+# Return cached results for the same upload and parameters, otherwise run the job and cache its results
+async def run_cached(endpoint, contents, params, model, job, *args):
+    key = result_key(endpoint, contents, params)
+    results = result_cache.get(key)
+    if results is not None:
+        results["cached"] = True
+        return results, {'queue_time': 0, 'compute_time': 0}
+
+    results, timings = await executor.run(model, job, *args)
+    add_stage("queue", timings["queue_time"])
+    result_cache.put(key, results)
+    results["cached"] = False
+
+    return results, timings
+
+
+# Local job queue for long running requests (job=true), e.g. JOB_DB="./jobs.db"
+job_queue = JobQueue(path=os.environ.get("JOB_DB", "jobs.db"),
+                     retention=float(os.environ.get("JOB_RETENTION", 24 * 3600)),
+                     max_finished=int(os.environ.get("JOB_MAX_FINISHED", 1000)))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 0.5))
+
+
+# Detection results of recent requests, kept so annotated images can be rendered on request
+ANNOTATION_CACHE_SIZE = int(os.environ.get("ANNOTATION_CACHE_SIZE", 32))
+annotations = OrderedDict()
+
+
+# Remember the upload and its plate or message boxes and give the caller an id to fetch the annotated image
+def cache_annotation(engine, contents, results):
+    detections = results.get("plates", results.get("messages"))
+    if detections is None:
+        return results
+
+    with stage("annotate"):
+        annotation_id = uuid.uuid4().hex
+        annotations[annotation_id] = (engine, contents, detections)
+        while len(annotations) > ANNOTATION_CACHE_SIZE:
+            annotations.popitem(last=False)
+
+    results["annotation_id"] = annotation_id
+    return results
+
+
+# Draw the cached boxes onto the upload and encode it as PNG
+def render_annotation(engine, contents, detections):
+    img = decode(contents).bgr  # a frame of its own, so it is safe to draw on
+
+    with stage("annotate"):
+        if engine == "car_reg":
+            img = engine_registry.module("car_reg").draw_licence_plates(img, detections)
+        else:
+            img = engine_registry.module("messages").draw_messages(img, detections)
+
+    with stage("serialise"):
+        _, png = cv2.imencode(".png", img)
+        return png.tobytes()
+
+
+# Add the queue and compute times to the results
+def add_timings(results, timings):
+    results["queue_time"] = results.get("queue_time", 0) + timings["queue_time"]
+    results["compute_time"] = results.get("compute_time", 0) + timings["compute_time"]
+
+    return results
 
 
 ####################################### Pre-processing ######################################################
-# Pre-process image: includes adaptive thresholding, skew correction and noise removal
-def pre_process(image_file_path, thresholding, skew_correction, noise_removal):
-    image = pre_processor.pre_process_image(image_file_path, thresholding, skew_correction, noise_removal)
+# Pre-processing pipeline: includes adaptive thresholding, skew correction and noise removal.
+# stages is an optional comma separated list (e.g. "noise_removal,skew_correction") that sets the order
+def get_pipeline(thresholding, skew_correction, noise_removal, stages=None):
+    try:
+        if stages is None:
+            return pre_processor.PreProcessingPipeline.from_flags(thresholding, skew_correction, noise_removal)
+        else:
+            return pre_processor.PreProcessingPipeline(stage.strip() for stage in stages.split(",") if stage.strip())
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+# Frame for the uploaded bytes (or an existing frame), decoded once here and shared by every stage after
+def decode(contents):
+    frame = Frame.of(contents)
+    with stage("decode"):
+        frame.bgr
+
+    return frame
+
+
+# Decode the upload and pre-process it
+def pre_process(contents, pipeline):
+    img = decode(contents)
+    with stage("pre_process"):
+        image = pipeline.run(img)
 
     return image
 
+########################## Inference jobs - run in the worker pool, off the event loop ##########################
+def keras_job(contents, pipeline):
+    new_image = pre_process(contents, pipeline)
+
+    return engine_class("keras").get_text(get_model("keras"), new_image)
+
+
+def keras_batch_job(contents_list, pipeline):
+    new_images = [pre_process(contents, pipeline) for contents in contents_list]
+
+    return engine_class("keras").get_text_batch(get_model("keras"), new_images)
+
+
+def tesseract_job(contents, pipeline, scale, tiled=False):
+    new_image = pre_process(contents, pipeline)
+
+    return engine_class("tesseract").get_text(get_model("tesseract"), new_image, scale, tiled)
+
+
+def easyocr_job(contents, pipeline, language, paragraph):
+    new_image = pre_process(contents, pipeline)
+
+    return engine_class("easyocr").get_text(get_model("easyocr"), new_image, language, paragraph)
+
+
+def car_reg_job(contents, confidence_threshold, class_threshold, nms_threshold):
+    img = decode(contents)
+
+    return engine_class("car_reg").get_text(get_model("car_reg"), img, confidence_threshold, class_threshold,
+                                              nms_threshold)
+
+
+# OpenCV reads videos from files, so the upload is written to a temporary one for the length of the job
+def car_reg_video_job(contents, params):
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(contents)
+        f.flush()
+
+        return engine_class("car_reg").get_text_video(get_model("car_reg"), f.name, params["sample_fps"],
+                                                      params["max_frames"] or None, params["batch_size"],
+                                                      params["confidence_threshold"], params["class_threshold"],
+                                                      params["nms_threshold"], params["iou_threshold"],
+                                                      params["max_missed"], params["reads"])
+
+
+def messages_job(contents):
+    img = decode(contents)
+
+    results = engine_class("messages").get_text(get_model("messages"), img)
+    with open("text.txt", "w+") as f:
+        f.write(results["text"])
+
+    return results
+
+
+def classify_job(contents):
+    img = decode(contents)
+
+    with stage("classify"):
+        return engine_class("classify").classify_image(get_model("classify"), img)
+
+
+# Model used by /submit_image for each category, anything else goes to EasyOCR
+CATEGORY_MODELS = {
+    "vehicle": "car_reg",
+    "document": "keras",
+    "sms": "messages",
+    "other": "easyocr",
+}
+
+
+# Shadow removal before the vehicle and document engines: "full" (the original, per channel at full resolution),
+# "fast" (background estimated at low resolution on the luminance; much quicker, but the pixels and so the text
+# can differ a little) or "none"
+SHADOW_REMOVAL = os.environ.get("SHADOW_REMOVAL", "full")
+if SHADOW_REMOVAL not in pre_processor.SHADOW_REMOVAL:
+    raise ValueError("Unknown SHADOW_REMOVAL: {} (use one of {})".format(
+        SHADOW_REMOVAL, ", ".join(pre_processor.SHADOW_REMOVAL)))
+remove_shadows = pre_processor.SHADOW_REMOVAL[SHADOW_REMOVAL]
+
+
+# Deployment settings that change the results of each endpoint. They are part of every cache key, so a
+# restart with other settings does not serve results (or a response shape) from the old ones out of the disk cache
+ENGINE_CONFIG = {
+    "tesseract": {'backend': TESSERACT_BACKEND, 'language': TESSERACT_LANGUAGE, 'tessdata_path': TESSDATA_PATH,
+                  'tile_workers': TESSERACT_TILE_WORKERS or os.cpu_count()},
+    "get_car_reg": {'detector': PLATE_DETECTOR_BACKEND},
+    "get_car_reg_video": {'detector': PLATE_DETECTOR_BACKEND},
+    "get_messages": {'detector': MESSAGE_DETECTOR_BACKEND},
+    "submit_image": {'shadow_removal': SHADOW_REMOVAL, 'labels': CLASSIFY_LABELS, 'threshold': CLASSIFY_THRESHOLD,
+                     'classifier': CLASSIFY_BACKEND, 'plate_detector': PLATE_DETECTOR_BACKEND,
+                     'message_detector': MESSAGE_DETECTOR_BACKEND},
+}
+
+
+def result_key(endpoint, contents, params=None):
+    return cache_key(endpoint, contents, params, ENGINE_CONFIG.get(endpoint))
+
+
+def category_model(category):
+    return CATEGORY_MODELS.get(category, "easyocr")
+
+
+# Run the engine for one category over several images (bytes or frames), in batches where the engine supports it.
+# The decoded views are dropped afterwards so a frame shared with the caller does not keep them
+def category_batch_job(contents_list, category):
+    imgs = [decode(contents) for contents in contents_list]
+    try:
+        return category_batch_results(imgs, category)
+    finally:
+        for img in imgs:
+            img.release()
+
+
+def category_batch_results(imgs, category):
+    if category == "sms":
+        return [engine_class("messages").get_text(get_model("messages"), img) for img in imgs]
+
+    # remove image shadows
+    with stage("pre_process"):
+        processed_images = [remove_shadows(img) for img in imgs]
+
+    if category == "vehicle":
+        return engine_class("car_reg").get_text_batch(get_model("car_reg"), processed_images)
+
+    elif category == "document":
+        return engine_class("keras").get_text_batch(get_model("keras"), processed_images)
+
+    else:
+        return [engine_class("easyocr").get_text(get_model("easyocr"), processed_image, "English", False)
+                for processed_image in processed_images]
+
+
+def classify_batch_job(contents_list):
+    imgs = [decode(contents) for contents in contents_list]
+
+    with stage("classify"):
+        probs, labels = engine_class("classify").classify_images(get_model("classify"), imgs)
+    return labels
+
+
+# One page of a document through the pre-processing and the chosen engine
+def document_page_job(engine, frame, pipeline, params):
+    if engine == "keras":
+        return keras_job(frame, pipeline)
+    if engine == "tesseract":
+        return tesseract_job(frame, pipeline, params["scale"], params["tiled"])
+
+    return easyocr_job(frame, pipeline, params["language"], params["paragraph"])
+
+
+def submit_image_job(frame, category):
+    results = category_batch_job([frame], category)[0]
+
+    with open("text.txt", "w+") as f:
+        if category == "sms":
+            text = "App: " + results["app"] + "\n\n"
+            f.write(text)
+
+        f.write(results["text"])
+
+    return results
+
+########################## Request handlers - shared by the endpoints and the job workers ##########################
+# Each takes the upload and a dict of JSON parameters and returns the results and timings
+async def handle_keras(contents, params):
+    pipeline = pre_processor.PreProcessingPipeline(params["stages"])
+
+    return await run_cached("keras", contents, params, "keras", keras_job, contents, pipeline)
+
+
+async def handle_tesseract(contents, params):
+    pipeline = pre_processor.PreProcessingPipeline(params["stages"])
+
+    return await run_cached("tesseract", contents, params, "tesseract", tesseract_job, contents, pipeline,
+                            params["scale"], params.get("tiled", False))
+
+
+async def handle_easyocr(contents, params):
+    pipeline = pre_processor.PreProcessingPipeline(params["stages"])
+
+    return await run_cached("easyocr", contents, params, "easyocr", easyocr_job, contents, pipeline,
+                            params["language"], params["paragraph"])
+
+
+async def handle_get_car_reg(contents, params):
+    results, timings = await run_cached("get_car_reg", contents, params, "car_reg", car_reg_job, contents,
+                                        params["confidence_threshold"], params["class_threshold"],
+                                        params["nms_threshold"])
+    cache_annotation("car_reg", contents, results)
+
+    return results, timings
+
+
+async def handle_get_car_reg_video(contents, params):
+    try:
+        return await run_cached("get_car_reg_video", contents, params, "car_reg", car_reg_video_job, contents,
+                                params)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+async def handle_get_messages(contents, params):
+    results, timings = await run_cached("get_messages", contents, params, "messages", messages_job, contents)
+    cache_annotation("messages", contents, results)
+
+    return results, timings
+
+
+async def handle_submit_image(contents, params):
+    key = result_key("submit_image", contents)
+    results = result_cache.get(key)
+    if results is not None:
+        results["cached"] = True
+        timings = {'queue_time': 0, 'compute_time': 0}
+    else:
+        # the classifier and the engine share one decode of the upload
+        frame = Frame(contents)
+        category, classify_timings = await executor.run("classify", classify_job, frame)
+        results, timings = await executor.run(category_model(category), submit_image_job, frame, category)
+        add_stage("queue", classify_timings["queue_time"] + timings["queue_time"])
+        results["category"] = category
+
+        result_cache.put(key, results)
+        results["cached"] = False
+        add_timings(results, classify_timings)
+
+    cache_annotation(category_model(results["category"]), contents, results)
+
+    return results, timings
+
+
+HANDLERS = {
+    "keras": handle_keras,
+    "tesseract": handle_tesseract,
+    "easyocr": handle_easyocr,
+    "get_car_reg": handle_get_car_reg,
+    "get_car_reg_video": handle_get_car_reg_video,
+    "get_messages": handle_get_messages,
+    "submit_image": handle_submit_image,
+}
+
+
+# Stage timings as a Server-Timing header value, in milliseconds
+def server_timing(stage_timings):
+    return ", ".join("{};dur={:.2f}".format(name, seconds * 1000) for name, seconds in stage_timings.items())
+
+
+# Run the request now, or with job=true queue it and return a job id to poll at /jobs/{job_id}.
+# With include_timings the seconds spent in each stage are added as "timings" and, with serialising, sent in a
+# Server-Timing header
+async def respond(endpoint, image_file_path, params, job=False, priority=0, include_timings=False):
+    with stage("read"):
+        contents = await image_file_path.read()
+
+    if job is True:
+        job_id = await asyncio.to_thread(job_queue.submit, endpoint, params, contents, image_file_path.filename,
+                                         priority)
+        return {'job_id': job_id, 'status': "queued"}
+
+    results, timings = await HANDLERS[endpoint](contents, params)
+    results["source_file"] = image_file_path.filename
+    add_timings(results, timings)
+
+    stage_timings = current_timings.get()
+    if include_timings is True and stage_timings is not None:
+        # on a copy, the results may be the cached ones
+        results = dict(results, timings=dict(stage_timings))
+
+    with stage("serialise"):
+        body = to_json(results)
+
+    # the Server-Timing header is made after serialising, so it includes that stage too
+    headers = {}
+    if include_timings is True and stage_timings is not None:
+        headers["Server-Timing"] = server_timing(stage_timings)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
 ################################## Optical character recognition #######################################
 # Extract text using Keras
 @app.post("/keras")
 async def keras(image_file_path: UploadFile=File(),
           thresholding: bool = False,
           skew_correction: bool = False,
-          noise_removal: bool = False):
+          noise_removal: bool = False,
+          stages: str = None,
+          timings: bool = False,
+          job: bool = False,
+          priority: int = 0):
 
-    global keras_model
+    pipeline = get_pipeline(thresholding, skew_correction, noise_removal, stages)
 
-    contents = await image_file_path.read()
-    img = Image.open(io.BytesIO(contents))
+    return await respond("keras", image_file_path, {'stages': pipeline.stages}, job, priority, timings)
 
-    new_image = pre_process(img, thresholding, skew_correction, noise_removal)
+# Extract text from many images using Keras, batching them through the detector and recogniser
+@app.post("/keras/batch")
+async def keras_batch(image_file_paths: List[UploadFile]=File(),
+                thresholding: bool = False,
+                skew_correction: bool = False,
+                noise_removal: bool = False,
+                stages: str = None):
 
-    if keras_model is None:
-        keras_model = KerasModel()
+    start_time = datetime.now()
+    pipeline = get_pipeline(thresholding, skew_correction, noise_removal, stages)
+    contents_list = [await image_file_path.read() for image_file_path in image_file_paths]
 
-    results = KerasModel.get_text(keras_model, new_image)
-    results["source_file"] = image_file_path.filename
+    results, timings = await executor.run("keras", keras_batch_job, contents_list, pipeline)
+    for image_file_path, result in zip(image_file_paths, results):
+        result["source_file"] = image_file_path.filename
 
-    return results
+    return add_timings({
+        'results': results,
+        'total_time': (datetime.now() - start_time).total_seconds()
+    }, timings)
 
 # Extract text using Tesseract
 @app.post("/tesseract")
@@ -75,22 +729,18 @@ async def tesseract(image_file_path: UploadFile,
               scale: int = 1,
               thresholding: bool = False,
               skew_correction: bool = False,
-              noise_removal: bool = False):
-
-    global tesseract_model
+              noise_removal: bool = False,
+              stages: str = None,
+              tiled: bool = False,
+              timings: bool = False,
+              job: bool = False,
+              priority: int = 0):
 
-    contents = await image_file_path.read()
-    img = Image.open(io.BytesIO(contents))
+    pipeline = get_pipeline(thresholding, skew_correction, noise_removal, stages)
 
-    new_image = pre_process(img, thresholding, skew_correction, noise_removal)
+    params = {'stages': pipeline.stages, 'scale': scale, 'tiled': tiled}
 
-    if tesseract_model is None:
-        tesseract_model = TesseractModel()
-
-    results = TesseractModel.get_text(tesseract_model, new_image, scale)
-    results["source_file"] = image_file_path.filename
-
-    return results
+    return await respond("tesseract", image_file_path, params, job, priority, timings)
 
 
 # Extract text using EasyOCR
@@ -100,115 +750,470 @@ async def easyocr(image_file_path: UploadFile=File(),
             paragraph: bool = False,
             thresholding: bool = False,
             skew_correction: bool = False,
-            noise_removal: bool = False):
-    global easyocr_model
+            noise_removal: bool = False,
+            stages: str = None,
+            timings: bool = False,
+            job: bool = False,
+            priority: int = 0):
 
-    contents = await image_file_path.read()
-    img = Image.open(io.BytesIO(contents))
+    pipeline = get_pipeline(thresholding, skew_correction, noise_removal, stages)
+    params = {'stages': pipeline.stages, 'language': language, 'paragraph': paragraph}
 
-    new_image = pre_process(img, thresholding, skew_correction, noise_removal)
+    return await respond("easyocr", image_file_path, params, job, priority, timings)
 
-    if easyocr_model is None:
-        easyocr_model = EasyOCRModel()
+# Report which EasyOCR readers are loaded and the pool hit/miss counts
+@app.get("/easyocr_pool_stats")
+def easyocr_pool_stats():
+    if "easyocr" not in models:
+        return {'readers': [], 'hits': 0, 'misses': 0}
 
-    results = EasyOCRModel.get_text(easyocr_model, new_image, language, paragraph)
-    results["source_file"] = image_file_path.filename
+    return models["easyocr"].reader_pool.stats()
 
-    return results
+
+@app.get("/tesseract_pool_stats")
+def tesseract_pool_stats():
+    if "tesseract" not in models or models["tesseract"].api_pool is None:
+        return {'engines': 0, 'language': TESSERACT_LANGUAGE}
+
+    return models["tesseract"].api_pool.stats()
 
 # Extract car registration plates from images
 @app.post("/get_car_reg")
-async def get_car_reg(image_file_path: UploadFile=File()):
-    global car_reg_model
+async def get_car_reg(image_file_path: UploadFile=File(),
+                confidence_threshold: float = 0.4,
+                class_threshold: float = 0.25,
+                nms_threshold: float = 0.45,
+                timings: bool = False,
+                job: bool = False,
+                priority: int = 0):
 
-    contents = await image_file_path.read()
-    img = Image.open(io.BytesIO(contents))
+    params = {'confidence_threshold': confidence_threshold, 'class_threshold': class_threshold,
+              'nms_threshold': nms_threshold}
 
-    if car_reg_model is None:
-        car_reg_model = ExtractLicencePlatesModel()
+    return await respond("get_car_reg", image_file_path, params, job, priority, timings)
 
-    results = ExtractLicencePlatesModel.get_text(car_reg_model, img)
-    results["source_file"] = image_file_path.filename
+# Read the licence plates in a video. sample_fps frames a second (0 for every frame, max_frames to stop early)
+# go through the detector batch_size at a time, boxes are tracked across frames by IoU and each plate is read
+# from its best reads crops, merged by vote. Returns one record per plate with first_seen and last_seen in
+# seconds. Long videos are best sent with job=true
+@app.post("/get_car_reg/video")
+async def get_car_reg_video(video_file_path: UploadFile=File(),
+                      sample_fps: float = 5,
+                      max_frames: int = 0,
+                      batch_size: int = 8,
+                      confidence_threshold: float = 0.4,
+                      class_threshold: float = 0.25,
+                      nms_threshold: float = 0.45,
+                      iou_threshold: float = 0.3,
+                      max_missed: float = 1.0,
+                      reads: int = 2,
+                      timings: bool = False,
+                      job: bool = False,
+                      priority: int = 0):
 
-    return results
+    if batch_size < 1 or reads < 1:
+        raise HTTPException(status_code=400, detail="batch_size and reads must be at least 1")
+
+    params = {'sample_fps': sample_fps, 'max_frames': max_frames, 'batch_size': batch_size,
+              'confidence_threshold': confidence_threshold, 'class_threshold': class_threshold,
+              'nms_threshold': nms_threshold, 'iou_threshold': iou_threshold, 'max_missed': max_missed,
+              'reads': reads}
+
+    return await respond("get_car_reg_video", video_file_path, params, job, priority, timings)
 
 # Extract messages from screenshots
 @app.post("/get_messages")
-async def get_messages(image_file_path: UploadFile=File()):
-    global message_model
+async def get_messages(image_file_path: UploadFile=File(),
+                 timings: bool = False,
+                 job: bool = False,
+                 priority: int = 0):
 
-    contents = await image_file_path.read()
-    img = Image.open(io.BytesIO(contents))
+    return await respond("get_messages", image_file_path, {}, job, priority, timings)
 
-    if message_model is None:
-        message_model = ExtractMessagesModel()
 
-    results = ExtractMessagesModel.get_text(message_model, img)
-    results["source_file"] = image_file_path.filename
-    with open("text.txt", "w+") as f:
-        f.write(results["text"])
+# Categorises image before deciding which ocr model to use.
+@app.post("/submit_image")
+async def submit_image(image_file_path: UploadFile=File(),
+                 timings: bool = False,
+                 job: bool = False,
+                 priority: int = 0):
 
-    return results
+    return await respond("submit_image", image_file_path, {}, job, priority, timings)
 
 
-# Categorises image before deciding which ocr model to use.
-@app.post("/submit_image")
-async def submit_image(image_file_path: UploadFile=File()):
-    global classify_model, easyocr_model, keras_model, car_reg_model, message_model
+# Images per classifier and engine batch in /submit_images
+SUBMIT_BATCH_SIZE = int(os.environ.get("SUBMIT_BATCH_SIZE", 8))
 
-    contents = await image_file_path.read()
-    img = Image.open(io.BytesIO(contents))
 
-    # load models and save them so that they don't need to be loaded for every run
-    if classify_model is None:
-        classify_model = ClassifyImageModel(model=None, processor=None)
+# Every file in a zip archive as (name, contents), skipping folders
+def unzip_images(contents):
+    with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+        return [(info.filename, archive.read(info)) for info in archive.infolist() if not info.is_dir()]
 
-    category = ClassifyImageModel.classify_image(classify_model, img)
 
-    # remove image shadows
-    processed_image = pre_processor.remove_shadows(img)
-    with open("text.txt", "w+") as f:
+def to_ndjson(record):
+    return to_json(record) + "\n"
 
-        if category == "vehicle":
-            if car_reg_model is None:
-                car_reg_model = ExtractLicencePlatesModel()
-            results = ExtractLicencePlatesModel.get_text(car_reg_model, processed_image)
 
-        elif category == "document":
-            if keras_model is None:
-                keras_model = KerasModel()
+# Classify the images in batches, queue each one for the engine of its category and yield the results
+# as NDJSON lines as soon as each engine batch finishes
+async def stream_submit_images(items):
+    results_queue = asyncio.Queue()
+    category_queues = {}
+    workers = []
+    misses = []
 
-            results = KerasModel.get_text(keras_model, processed_image)
+    def error_record(index, source_file, error):
+        return {'index': index, 'source_file': source_file, 'error': getattr(error, "detail", str(error)),
+                'status_code': getattr(error, "status_code", 500)}
 
-        elif category == "sms":
-            if message_model is None:
-                message_model = ExtractMessagesModel()
-            results = ExtractMessagesModel.get_text(message_model, img)
-            text = "App: " + results["app"] + "\n\n"
-            f.write(text)
+    # engine for one category: takes whatever is queued (up to a batch) and runs it together
+    async def category_worker(category, queue):
+        finished = False
+        while not finished:
+            batch = []
+            item = await queue.get()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= SUBMIT_BATCH_SIZE or queue.empty():
+                    break
+                item = queue.get_nowait()
+            finished = item is None
+
+            if len(batch) == 0:
+                continue
+
+            try:
+                results, timings = await executor.run(category_model(category), category_batch_job,
+                                                      [contents for index, source_file, contents in batch],
+                                                      category)
+            except Exception as error:
+                for index, source_file, contents in batch:
+                    await results_queue.put(error_record(index, source_file, error))
+                continue
+
+            for (index, source_file, contents), results in zip(batch, results):
+                results["category"] = category
+                result_cache.put(result_key("submit_image", contents), results)
+                results["cached"] = False
+                results["index"] = index
+                results["source_file"] = source_file
+                cache_annotation(category_model(category), contents, results)
+                await results_queue.put(results)
+
+    async def classify_all():
+        for start in range(0, len(misses), SUBMIT_BATCH_SIZE):
+            chunk = misses[start:start + SUBMIT_BATCH_SIZE]
+            try:
+                labels, timings = await executor.run("classify", classify_batch_job,
+                                                     [contents for index, source_file, contents in chunk])
+            except Exception as error:
+                for index, source_file, contents in chunk:
+                    await results_queue.put(error_record(index, source_file, error))
+                continue
+
+            for item, label in zip(chunk, labels):
+                if label not in category_queues:
+                    category_queues[label] = asyncio.Queue()
+                    workers.append(asyncio.create_task(category_worker(label, category_queues[label])))
+                await category_queues[label].put(item)
+
+        for queue in category_queues.values():
+            await queue.put(None)
+
+    # cached results and files that are not images go out straight away
+    for index, (source_file, contents) in enumerate(items):
+        try:
+            Image.open(io.BytesIO(contents))
+        except Exception:
+            error = HTTPException(status_code=400, detail="Not an image file that can be read")
+            yield to_ndjson(error_record(index, source_file, error))
+            continue
+
+        results = result_cache.get(result_key("submit_image", contents))
+        if results is None:
+            # only the bytes wait here; each worker call decodes its own batch and drops it when done
+            misses.append((index, source_file, contents))
+            continue
+
+        results["cached"] = True
+        results["index"] = index
+        results["source_file"] = source_file
+        cache_annotation(category_model(results["category"]), contents, results)
+        yield to_ndjson(results)
+
+    classifier = asyncio.create_task(classify_all())
+    try:
+        for _ in range(len(misses)):
+            yield to_ndjson(await results_queue.get())
+
+        await classifier
+        await asyncio.gather(*workers)
+    finally:
+        # also reached when the client disconnects part way through. The classifier goes first, as it starts
+        # the category workers
+        classifier.cancel()
+        await asyncio.gather(classifier, return_exceptions=True)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+# Categorise and read many images (or zip archives of images) at once. Images are classified in batches,
+# grouped by category and run through each engine in batches. One JSON line per file is streamed back
+# as soon as its batch is done, so the order of the lines is not the upload order - use "index"
+@app.post("/submit_images")
+async def submit_images(image_file_paths: List[UploadFile]=File()):
+    items = []
+    for image_file_path in image_file_paths:
+        contents = await image_file_path.read()
+        if zipfile.is_zipfile(io.BytesIO(contents)):
+            items += unzip_images(contents)
         else:
-            if easyocr_model is None:
-                easyocr_model = EasyOCRModel()
+            items.append((image_file_path.filename, contents))
 
-            results = EasyOCRModel.get_text(easyocr_model, processed_image, "English", False)
-        bytes_image = io.BytesIO()
-        img.save(bytes_image, format='PNG')
+    return StreamingResponse(stream_submit_images(items), media_type="application/x-ndjson")
 
-        f.write(results["text"])
 
-    results["source_file"] = image_file_path.filename
+# Pages waiting to be recognised per document request. With the pages being recognised (the engine's
+# INFERENCE_CONCURRENCY) and the one being rendered, this bounds the pages in memory whatever the length
+DOCUMENT_QUEUE_PAGES = int(os.environ.get("DOCUMENT_QUEUE_PAGES", 2))
+DOCUMENT_ENGINES = ("keras", "tesseract", "easyocr")
 
-    return results
 
+# Rasterise the pages one at a time into a bounded queue, recognise them with as many workers as the engine
+# runs at once, and yield one NDJSON line per page as soon as it is done
+async def stream_document(document, engine, pipeline, params):
+    loop = asyncio.get_running_loop()
+    page_queue = asyncio.Queue(maxsize=DOCUMENT_QUEUE_PAGES)
+    results_queue = asyncio.Queue()
+    workers = executor.concurrency.get(engine, 1)
+    pages = len(document)
+
+    def error_record(number, error):
+        return {'page': number, 'pages': pages, 'error': getattr(error, "detail", str(error)),
+                'status_code': getattr(error, "status_code", 500)}
+
+    async def render_pages():
+        for number in range(1, pages + 1):
+            try:
+                with stage("render"):
+                    image = await loop.run_in_executor(None, document.page, number)
+            except Exception as error:
+                await results_queue.put(error_record(number, error))
+                continue
+
+            await page_queue.put((number, Frame(image)))
+
+        for _ in range(workers):
+            await page_queue.put(None)
+
+    async def recognise_pages():
+        item = await page_queue.get()
+        while item is not None:
+            number, frame = item
+            try:
+                results, timings = await executor.run(engine, document_page_job, engine, frame, pipeline, params)
+                results["page"] = number
+                results["pages"] = pages
+                await results_queue.put(results)
+            except Exception as error:
+                await results_queue.put(error_record(number, error))
+
+            item = await page_queue.get()
+
+    tasks = [asyncio.create_task(render_pages())] + [asyncio.create_task(recognise_pages())
+                                                     for _ in range(workers)]
+    try:
+        for _ in range(pages):
+            yield to_ndjson(await results_queue.get())
+    finally:
+        # also reached when the client disconnects part way through
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        document.close()
+
+
+# Read a multi-page PDF or TIFF (or a single image) with Keras, Tesseract or EasyOCR. Pages are rasterised
+# lazily, PDFs at dpi, and one JSON line per page is streamed back as each finishes, so the lines are not
+# necessarily in page order - use "page"
+@app.post("/document")
+async def document(document_file_path: UploadFile=File(),
+             engine: str = "tesseract",
+             dpi: int = 200,
+             scale: int = 1,
+             tiled: bool = False,
+             language: str = "English",
+             paragraph: bool = False,
+             thresholding: bool = False,
+             skew_correction: bool = False,
+             noise_removal: bool = False,
+             stages: str = None):
+
+    if engine not in DOCUMENT_ENGINES:
+        raise HTTPException(status_code=400, detail="engine must be one of {}".format(", ".join(DOCUMENT_ENGINES)))
+    if not engine_registry.is_enabled(engine):
+        raise EngineDisabled(engine)
+
+    pipeline = get_pipeline(thresholding, skew_correction, noise_removal, stages)
+    params = {'scale': scale, 'tiled': tiled, 'language': language, 'paragraph': paragraph}
+
+    contents = await document_file_path.read()
+    try:
+        document = Document(contents, dpi)
+    except UnsupportedDocument as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    return StreamingResponse(stream_document(document, engine, pipeline, params), media_type="application/x-ndjson")
+
+
+# Render the boxes found by /get_car_reg, /get_messages or /submit_image onto the image, using the
+# annotation_id from that response. Drawing only happens here, not on the recognition path
+@app.get("/annotated_image/{annotation_id}")
+async def annotated_image(annotation_id: str):
+    if annotation_id not in annotations:
+        raise HTTPException(status_code=404, detail="Unknown or expired annotation_id")
+
+    png, timings = await executor.run("annotate", render_annotation, *annotations[annotation_id])
+
+    return Response(content=png, media_type="image/png")
+
+
+########################################### Jobs ###########################################################
+# Take jobs off the queue and run them through the same handlers as the endpoints
+async def job_worker():
+    cleaned_at = 0
+    while True:
+        if datetime.now().timestamp() - cleaned_at > 60:
+            await asyncio.to_thread(job_queue.cleanup)
+            cleaned_at = datetime.now().timestamp()
+
+        job = await asyncio.to_thread(job_queue.claim)
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+
+        stage_timings = start_timings()
+        try:
+            results, timings = await HANDLERS[job["endpoint"]](job["contents"], job["params"])
+            results["source_file"] = job["source_file"]
+            results["timings"] = dict(stage_timings)
+            await asyncio.to_thread(job_queue.complete, job["id"], add_timings(results, timings))
+        except Overloaded:
+            # the model is busy with direct requests, try again shortly
+            await asyncio.to_thread(job_queue.requeue, job["id"])
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+        except Exception as error:
+            await asyncio.to_thread(job_queue.fail, job["id"], error)
 
-# Load all the ocr and classification models - added to increase speed
+        observe_stages("job:" + job["endpoint"], stage_timings)
+
+
+job_workers = []
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    await asyncio.to_thread(job_queue.recover_running)
+    for _ in range(JOB_WORKERS):
+        job_workers.append(asyncio.create_task(job_worker()))
+
+
+# Status, timings and (once done) results of a job
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job_id")
+
+    return job
+
+
+# Cancel a job. Queued jobs never run; running jobs finish but their results are discarded
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    status = await asyncio.to_thread(job_queue.cancel, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job_id")
+
+    return {'job_id': job_id, 'status': status}
+
+
+# Queue depth and job timings
+@app.get("/jobs")
+async def job_stats():
+    return await asyncio.to_thread(job_queue.stats)
+
+
+# Inference pool gauges are read from the executor when /metrics is scraped
+def collect_executor_metrics():
+    stats = executor.stats()
+    for model, waiting in stats["waiting"].items():
+        inference_waiting.set(waiting, model=model)
+    for model, running in stats["running"].items():
+        inference_running.set(running, model=model)
+
+
+metrics.collectors.append(collect_executor_metrics)
+
+
+# Prometheus metrics: latency histograms per endpoint and stage, model loads and in-flight requests
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Result cache hit and miss counts
+@app.get("/cache_stats")
+def cache_stats():
+    return result_cache.stats()
+
+
+# Liveness check - answered on the event loop even while inference is running
+@app.get("/health")
+async def health():
+    return {'status': "ok", 'executor': executor.stats()}
+
+
+# Start loading the PRELOAD_MODELS in the background; /ready reports when they are done.
+# With INFERENCE_EXECUTOR=process the worker processes still load their own copies on first use
+preload_tasks = []
+
+
+@app.on_event("startup")
+async def start_preloading():
+    preload_tasks.append(asyncio.create_task(preload_models(PRELOAD_MODELS)))
+
+
+# Readiness check - 503 until every model in PRELOAD_MODELS has loaded and warmed up
+@app.get("/ready")
+async def ready():
+    ready = all(model_status.get(name, {}).get("status") == "ready" for name in PRELOAD_MODELS)
+    content = {
+        'ready': ready,
+        'models': {name: model_status.get(name, {'status': "waiting"}) for name in PRELOAD_MODELS},
+        'memory_mb': process_memory_mb(),
+    }
+
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
+# Status, load time and memory of every model loaded so far
+@app.get("/models")
+async def model_stats():
+    return {'models': model_status, 'memory_mb': process_memory_mb()}
+
+
+# Enabled engines and how long importing each one took
+@app.get("/engines")
+async def engine_stats():
+    return engine_registry.stats()
+
+
+# Load and warm up all the enabled ocr and classification models in parallel - added to increase speed
 @app.get("/load_all_models")
-def load_all_models():
-    global classify_model, keras_model, easyocr_model, tesseract_model, car_reg_model, message_model
-    
-    classify_model = ClassifyImageModel(model=None, processor=None)
-    keras_model = KerasModel()
-    easyocr_model = EasyOCRModel()
-    tesseract_model = TesseractModel()
-    car_reg_model = ExtractLicencePlatesModel()
-    message_model = ExtractMessagesModel()
+async def load_all_models():
+    await preload_models(engine_registry.enabled)
+
+    return {'models': model_status, 'memory_mb': process_memory_mb()}
@@ -0,0 +1,133 @@
+import threading
+
+# Prometheus' default latency buckets, in seconds, with a few longer ones for the slow engines
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values)) + (extra or [])
+    if not pairs:
+        return ""
+
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for name, value in pairs]
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in escaped) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+# Minimal Prometheus metrics in the text exposition format, so the service needs no extra client library
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, [], value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} {}".format(self.name, self.kind)]
+        for name, key, extra, value in self.samples():
+            lines.append("{}{} {}".format(name, format_labels(self.label_names, key, extra), format_value(value)))
+
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        Gauge.inc(self, -amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            series = self.values[key]
+
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][n] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    samples.append((self.name + "_bucket", key, [("le", format_value(bound))], cumulative))
+                samples.append((self.name + "_sum", key, [], series['sum']))
+                samples.append((self.name + "_count", key, [], series['count']))
+
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # functions called before rendering, e.g. to update gauges from other stats
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, label_names=()):
+        return MetricsRegistry.add(self, Counter(name, description, label_names))
+
+    def gauge(self, name, description, label_names=()):
+        return MetricsRegistry.add(self, Gauge(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        return MetricsRegistry.add(self, Histogram(name, description, label_names, buckets))
+
+    def render(self):
+        for collect in self.collectors:
+            collect()
+
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,96 @@
+# One decoded image shared by the pre-processing and every engine of a request.
+# The upload is decoded once, straight to BGR, and the other views are made from that buffer on first use
+# and kept. Treat the views as read-only: they are shared, so draw on a copy
+import io
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class Frame:
+    # image is the encoded bytes of an upload or a path to a file (decoded on first use), a PIL image or a
+    # BGR/grey array
+    def __init__(self, image):
+        self.contents = None
+        self.views = {}
+        self.lock = threading.RLock()
+
+        if isinstance(image, (bytes, bytearray)):
+            self.contents = bytes(image)
+        elif isinstance(image, str):
+            with open(image, "rb") as f:
+                self.contents = f.read()
+        elif isinstance(image, Image.Image):
+            self.views['pil'] = image
+        elif isinstance(image, np.ndarray):
+            self.views['gray' if image.ndim == 2 else 'bgr'] = image
+        else:
+            raise TypeError("Cannot make a frame from {}".format(type(image).__name__))
+
+    # The frame itself if image already is one, otherwise a new frame around it
+    @classmethod
+    def of(cls, image):
+        return image if isinstance(image, cls) else cls(image)
+
+    # Frames go to worker processes as their encoded bytes (or their original image) without the other views
+    def __getstate__(self):
+        if self.contents is not None:
+            return {'contents': self.contents, 'views': {}}
+
+        base = [name for name in ('bgr', 'gray', 'pil') if name in self.views][0]
+        return {'contents': None, 'views': {base: self.views[base]}}
+
+    def __setstate__(self, state):
+        self.contents = state['contents']
+        self.views = state['views']
+        self.lock = threading.RLock()
+
+    # Drop the decoded views once they are no longer needed. A frame made from bytes keeps only those (and
+    # decodes again if used), one made from an image keeps that image
+    def release(self):
+        with self.lock:
+            if self.contents is not None:
+                self.views = {}
+            else:
+                base = [name for name in ('bgr', 'gray', 'pil') if name in self.views][0]
+                self.views = {base: self.views[base]}
+
+    def view(self, name, make):
+        if name not in self.views:
+            with self.lock:
+                if name not in self.views:
+                    self.views[name] = make()
+
+        return self.views[name]
+
+    def decode(self):
+        if self.contents is not None:
+            img = cv2.imdecode(np.frombuffer(self.contents, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+            if img is not None:
+                return img
+
+            # formats OpenCV cannot read (e.g. GIF) go through PIL
+            self.views['pil'] = Image.open(io.BytesIO(self.contents))
+
+        if 'pil' in self.views:
+            return cv2.cvtColor(np.asarray(self.views['pil'].convert("RGB")), cv2.COLOR_RGB2BGR)
+
+        return cv2.cvtColor(self.views['gray'], cv2.COLOR_GRAY2BGR)
+
+    @property
+    def bgr(self):
+        return Frame.view(self, 'bgr', lambda: Frame.decode(self))
+
+    @property
+    def gray(self):
+        return Frame.view(self, 'gray', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    # made from the decoded BGR without keeping an RGB copy as well
+    @property
+    def pil(self):
+        return Frame.view(self, 'pil', lambda: Image.fromarray(cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)))
+
+    @property
+    def shape(self):
+        return self.bgr.shape
@@ -0,0 +1,80 @@
+# Reading order for OCR output: group word boxes into columns and lines and build the text
+import numpy as np
+
+
+# Convert quadrilaterals (N x 4 x 2 points) or (N x 4) [x0, y0, x1, y1] boxes into [x0, y0, x1, y1]
+def boxes_to_xyxy(boxes):
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if len(boxes) == 0:
+        return np.zeros((0, 4))
+
+    if boxes.ndim == 3:
+        return np.concatenate([boxes.min(axis=1), boxes.max(axis=1)], axis=1)
+
+    return boxes
+
+
+# Start a new group wherever the sorted intervals stop overlapping by more than gap
+def interval_groups(starts, ends, gap):
+    order = np.argsort(starts, kind="stable")
+    reach = np.maximum.accumulate(ends[order])
+
+    breaks = np.zeros(len(order), dtype=np.int64)
+    breaks[1:] = starts[order][1:] > reach[:-1] + gap
+
+    groups = np.empty(len(order), dtype=np.int64)
+    groups[order] = np.cumsum(breaks)
+    return groups
+
+
+# Split the page into columns separated by vertical gutters wider than gap
+def find_columns(xyxy, gap):
+    return interval_groups(xyxy[:, 0], xyxy[:, 2], gap)
+
+
+# Number the lines inside each column: a new line starts when the vertical centre of the next box
+# (top to bottom) moves by more than height / height_variation
+def find_lines(xyxy, columns, height_variation=2):
+    centres = (xyxy[:, 1] + xyxy[:, 3]) / 2
+    heights = xyxy[:, 3] - xyxy[:, 1]
+    tolerance = np.median(heights) / height_variation
+
+    order = np.lexsort((centres, columns))
+    breaks = np.ones(len(order), dtype=np.int64)
+    breaks[1:] = (columns[order][1:] != columns[order][:-1]) | (np.diff(centres[order]) > tolerance)
+
+    lines = np.empty(len(order), dtype=np.int64)
+    lines[order] = np.cumsum(breaks) - 1
+    return lines
+
+
+# Order words into lines (top to bottom) and words (left to right). With split_columns=True the page is first
+# split into columns (left to right) at gutters wider than twice the line height; that is off by default because
+# key-value rows such as receipts ("Total 42.00") would be read as a column of keys then a column of values.
+# Returns the text with one line per row and the text and [x0, y0, x1, y1] box of every line
+def reading_order(boxes, texts, height_variation=2, split_columns=False):
+    xyxy = boxes_to_xyxy(boxes)
+    if len(xyxy) == 0:
+        return {'text': "", 'lines': [], 'order': []}
+
+    texts = np.asarray(texts, dtype=object)
+    if split_columns is True:
+        columns = find_columns(xyxy, np.median(xyxy[:, 3] - xyxy[:, 1]) * 2)
+    else:
+        columns = np.zeros(len(xyxy), dtype=np.int64)
+    lines = find_lines(xyxy, columns, height_variation)
+
+    order = np.lexsort((xyxy[:, 0], lines))
+    sorted_lines = lines[order]
+    starts = np.flatnonzero(np.r_[True, sorted_lines[1:] != sorted_lines[:-1]])
+
+    sorted_boxes = xyxy[order]
+    line_boxes = np.concatenate([np.minimum.reduceat(sorted_boxes[:, :2], starts, axis=0),
+                                 np.maximum.reduceat(sorted_boxes[:, 2:], starts, axis=0)], axis=1)
+    line_texts = [" ".join(words) for words in np.split(texts[order], starts[1:])]
+
+    return {
+        'text': "\n".join(line_texts),
+        'lines': [{'text': text, 'box': box} for text, box in zip(line_texts, line_boxes.round(1).tolist())],
+        'order': order.tolist()
+    }
@@ -2,10 +2,13 @@ import os
 import easyocr
 import cv2
 import numpy as np
-import plotly.express as px
 from pydantic import BaseModel
 from datetime import datetime
 from PIL import Image
+from .yolo import make_blob, filter_detections, YoloDetector
+from .timing import stage
+from .frame import Frame
+from .video import sample_frames, PlateTracker, vote
 
 class ExtractLicencePlates(BaseModel):
     source_file: str
@@ -16,7 +19,8 @@ class ExtractLicencePlates(BaseModel):
 
 # Extract car licence plates from images and get the reg number
 class ExtractLicencePlatesModel:
-    def __init__(self):
+    # backend is "opencv" (cv2.dnn) or "onnxruntime", the threads only apply to ONNX Runtime
+    def __init__(self, backend="opencv", intra_op_threads=0, inter_op_threads=0):
         # Load recogniser model
         self.reader = easyocr.Reader(['en'])
 
@@ -25,10 +29,10 @@ class ExtractLicencePlatesModel:
         self.INPUT_HEIGHT = 640
 
         # Load detector model
-        self.model = cv2.dnn.readNetFromONNX('./models/license_plate_detector.onnx')
-        self.model.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
-        self.model.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.model = YoloDetector('./models/license_plate_detector.onnx', backend, intra_op_threads, inter_op_threads)
 
+        # Crops at least this many times wider than tall are single-line plates and skip the text detector
+        self.TIGHT_ASPECT_RATIO = 1.5
 
     # extract text
     def extract_text(self, image, bbox):
@@ -50,119 +54,242 @@ class ExtractLicencePlatesModel:
 
             return extracted_text
 
+    # Cut the plates kept by non-maximum suppression out of the image, clipped to the image edges
+    def crop_plates(self, image, licence_coords, index):
+        rows, columns = image.shape[:2]
+
+        crops = []
+        for i in index:
+            x, y, w, h = licence_coords[i]
+            crops.append(image[max(y, 0):min(y + h, rows), max(x, 0):min(x + w, columns)])
+
+        return crops
+
+    # Recognise grey crops that are already tight around their text as one box each, without running the
+    # text detector again. On CPU easyocr recognises box by box anyway, so the crops are not stacked together
+    def recognise_crops(self, crops):
+        texts = []
+        for crop in crops:
+            grey = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+            rows, columns = grey.shape
+            results = self.reader.recognize(grey, horizontal_list=[[0, columns, 0, rows]], free_list=[])
+            texts.append(" ".join(text for box, text, confidence in results))
+
+        return texts
+
+    # Read the text of many plate crops, from one image or several. Tight crops are recognised without running
+    # the text detector again; the rest (e.g. two-line plates) use full detection
+    def read_plates(self, crops):
+        texts = [""] * len(crops)
+        tight = []
+
+        for n, crop in enumerate(crops):
+            # shape will be 0 if the plate is outside the image
+            if 0 in crop.shape:
+                continue
+
+            if crop.shape[1] / crop.shape[0] >= self.TIGHT_ASPECT_RATIO:
+                tight.append(n)
+            else:
+                rows, columns = crop.shape[:2]
+                texts[n] = ExtractLicencePlatesModel.extract_text(self, crop, (0, 0, columns, rows))
+
+        if len(tight) > 0:
+            tight_texts = ExtractLicencePlatesModel.recognise_crops(self, [crops[n] for n in tight])
+            for n, text in zip(tight, tight_texts):
+                texts[n] = text
+
+        return texts
+
     # Locate licence plates
     def detect_licence_plates(self, img):
-        # Reshape image
-        image = img.copy()
-        rows, columns, channels = image.shape
+        input_images, predictions = ExtractLicencePlatesModel.detect_licence_plates_batch(self, [img])
 
-        max_rc = max(rows, columns)
-        input_image = np.zeros((max_rc, max_rc, 3), dtype=np.uint8)
-        input_image[0:rows, 0:columns] = image[:, :, :3]
+        return input_images[0], predictions[0]
 
-        # 1/255 = scale factor
-        blob = cv2.dnn.blobFromImage(input_image, 1 / 255, (self.INPUT_WIDTH, self.INPUT_HEIGHT), swapRB=True, crop=False)
-        self.model.setInput(blob)
-        predictions = self.model.forward()
-        detections = predictions[0]
+    # Locate licence plates in several images with one forward pass
+    def detect_licence_plates_batch(self, imgs):
+        # Reshape images
+        input_images, blob, factors = make_blob(imgs, self.INPUT_WIDTH)
+        predictions = YoloDetector.forward(self.model, blob)
 
-        return input_image, detections
+        return input_images, predictions
 
     # Filter boxes based on confidence and probability scores
-    def filter_licence_coords(self, input_image, detections):
-        # center x, center y, width, height, confidence, probability
-        boxes = []
-        confidences = []
-
-        image_width, image_height = input_image.shape[:2]  # only get image width and height
-        x_factor = image_width / self.INPUT_WIDTH
-        y_factor = image_height / self.INPUT_HEIGHT
-
-        for i in range(len(detections)):
-            rows = detections[i]
-            confidence = rows[4]  # confidence of detecting license plate
-            if confidence > 0.4:  # 40%
-                class_score = rows[5]  # probability score of license plate
-                if class_score > 0.25:  # 25%
-                    center_x, center_y, width, height = rows[0:4]
-
-                    left = int((center_x - 0.5 * width) * x_factor)
-                    top = int((center_y - 0.5 * height) * y_factor)
-                    width = int(width * x_factor)
-                    height = int(height * y_factor)
-                    box = np.array([left, top, width, height])
-
-                    confidences.append(confidence)
-                    boxes.append(box)
-
-        # clean
-        boxes_np = np.array(boxes).tolist()
-        confidences_np = np.array(confidences).tolist()
-
-        # non-maximum suppression
-        index = cv2.dnn.NMSBoxes(boxes_np, confidences_np, 0.25, 0.45)
-        return boxes_np, confidences_np, index
-
-    # Annotate input image with boxes and car reg
-    def annotate_image(self, image, licence_coords, confidences_np, index):
+    def filter_licence_coords(self, input_image, detections, confidence_threshold=0.4, class_threshold=0.25,
+                              nms_threshold=0.45):
+        return ExtractLicencePlatesModel.filter_licence_coords_batch(self, [input_image], [detections],
+                                                                     confidence_threshold, class_threshold,
+                                                                     nms_threshold)[0]
+
+    # Filter the boxes of several images at once. Returns one (boxes, confidences, index) tuple per image
+    def filter_licence_coords_batch(self, input_images, detections, confidence_threshold=0.4, class_threshold=0.25,
+                                    nms_threshold=0.45):
+        # the padded images are square, so one factor scales both x and y
+        factors = [input_image.shape[0] / self.INPUT_WIDTH for input_image in input_images]
+
+        return filter_detections(detections, factors, confidence_threshold, class_threshold, nms_threshold)
+
+    # Combine the text of every plate found. Falls back to reading the whole image if no plate had text
+    def combine_plate_text(self, image, plates):
         plate_detected = True
         licence_text = ""
 
-        # for each licence plate detected
-        for i in index:
-            x, y, w, h = licence_coords[i]
-
-            # Plate detection confidence
-            plate_confidence = confidences_np[i]
-            confidence_text = 'plate: {:.0f}%'.format(plate_confidence * 100)
-            index_licence_text = ExtractLicencePlatesModel.extract_text(self, image, licence_coords[i])
-
-            if index_licence_text != "":
-                licence_text = licence_text + index_licence_text + "\n"
-
-            # Highlight plate
-            cv2.rectangle(image, (x, y), (x + w, y + h), (255, 0, 255), 2)
-            cv2.rectangle(image, (x, y - 30), (x + w, y), (255, 0, 255), -1)
-            cv2.rectangle(image, (x, y + h), (x + w, y + h + 25), (0, 0, 0), -1)
-
-            cv2.putText(image, confidence_text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 1)
-            cv2.putText(image, licence_text, (x, y + h + 27), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 1)
+        for plate in plates:
+            if plate['text'] != "":
+                licence_text = licence_text + plate['text'] + "\n"
 
         if licence_text == "":
             plate_detected = False
             results = self.reader.readtext(image, paragraph=True)
 
             for box, text in results:
-                print(box)
                 licence_text = licence_text + text + "\n"
 
             print("Licence plate not detected \nText found:", licence_text)
 
         licence_text = licence_text[:-1]
-        return image, licence_text, plate_detected
+        return licence_text, plate_detected
 
     # Detect car licence plates and extract text
-    def get_text(self, image_file_path):
-        start_time = datetime.now()
-
-        image_file_path = np.array(image_file_path, dtype="uint8")
-        img = cv2.cvtColor(image_file_path, cv2.COLOR_BGR2RGB)
-
-        input_image, detections = ExtractLicencePlatesModel.detect_licence_plates(self, img)
-        boxes_np, confidences_np, index = ExtractLicencePlatesModel.filter_licence_coords(self, input_image, detections)
-        result_img, extracted_text, plate_detected = ExtractLicencePlatesModel.annotate_image(self, img, boxes_np, confidences_np, index)
+    def get_text(self, image_file_path, confidence_threshold=0.4, class_threshold=0.25, nms_threshold=0.45):
+        return ExtractLicencePlatesModel.get_text_batch(self, [image_file_path], confidence_threshold, class_threshold,
+                                                        nms_threshold)[0]
 
-        fig = px.imshow(result_img)
-        fig.update_layout(width=700, height=400, margin=dict(l=10, r=10, b=10, t=10))
-        fig.update_xaxes(showticklabels=False).update_yaxes(showticklabels=False)
-        fig.show()
+    # Detect and read the plates of several images: one detector pass, then every plate is read
+    def get_text_batch(self, images, confidence_threshold=0.4, class_threshold=0.25, nms_threshold=0.45):
+        start_time = datetime.now()
 
-        result = {
+        imgs = [Frame.of(image).bgr for image in images]
+
+        with stage("detect"):
+            input_images, detections = ExtractLicencePlatesModel.detect_licence_plates_batch(self, imgs)
+            filtered = ExtractLicencePlatesModel.filter_licence_coords_batch(self, input_images, detections,
+                                                                             confidence_threshold,
+                                                                             class_threshold,
+                                                                             nms_threshold)
+
+        # read every plate of every image together
+        with stage("recognise"):
+            crops = []
+            for img, (boxes_np, confidences_np, index) in zip(imgs, filtered):
+                crops += ExtractLicencePlatesModel.crop_plates(self, img, boxes_np, index)
+            plate_texts = iter(ExtractLicencePlatesModel.read_plates(self, crops))
+
+        results = []
+        for img, (boxes_np, confidences_np, index) in zip(imgs, filtered):
+            plates = []
+            for i in index:
+                plates.append({'box': boxes_np[i], 'confidence': confidences_np[i], 'text': next(plate_texts)})
+
+            # falls back to reading the whole image when no plate had text
+            with stage("recognise"):
+                extracted_text, plate_detected = ExtractLicencePlatesModel.combine_plate_text(self, img, plates)
+
+            results.append({
+                'source_file': "",
+                'plate_detected': plate_detected,
+                'text': extracted_text,
+                'plates': plates,
+                'confidence': None,
+                'detection_time': (datetime.now() - start_time).total_seconds() / len(images),
+            })
+
+        return results
+
+    # Read every finished track's best crops and merge each track's reads by vote
+    def read_tracks(self, tracks):
+        crops = [candidate[3] for track in tracks for candidate in track.candidates]
+        texts = iter(ExtractLicencePlatesModel.read_plates(self, crops) if crops else [])
+
+        plates = []
+        for track in tracks:
+            reads = [next(texts) for _ in track.candidates]
+            text, agreement = vote(reads)
+            best = track.candidates[0]
+            plates.append({
+                'track': track.track_id,
+                'text': text,
+                'reads': reads,
+                'agreement': agreement,
+                'box': best[2],
+                'box_time': round(best[1], 3),
+                'confidence': track.best_confidence,
+                'first_seen': round(track.first_seen, 3),
+                'last_seen': round(track.last_seen, 3),
+                'frames': track.frames,
+            })
+
+        return plates
+
+    # Detect, track and read the plates in a video file. sample_fps frames a second are decoded and run through
+    # the detector batch_size at a time; detections are tracked across frames and each plate is read at most
+    # reads times. Returns one record per plate with the times (in seconds) it was first and last seen
+    def get_text_video(self, path, sample_fps=5, max_frames=None, batch_size=8, confidence_threshold=0.4,
+                       class_threshold=0.25, nms_threshold=0.45, iou_threshold=0.3, max_missed=1.0, reads=2):
+        start_time = datetime.now()
+        tracker = PlateTracker(iou_threshold, max_missed, reads)
+        plates = []
+        frames_sampled = 0
+
+        frames = sample_frames(path, sample_fps, max_frames)
+        finished = False
+        while not finished:
+            with stage("decode"):
+                batch = []
+                for timestamp, frame in frames:
+                    batch.append((timestamp, frame))
+                    if len(batch) >= batch_size:
+                        break
+                finished = len(batch) < batch_size
+
+            if batch:
+                frames_sampled += len(batch)
+                with stage("detect"):
+                    imgs = [frame for timestamp, frame in batch]
+                    input_images, detections = ExtractLicencePlatesModel.detect_licence_plates_batch(self, imgs)
+                    filtered = ExtractLicencePlatesModel.filter_licence_coords_batch(self, input_images, detections,
+                                                                                     confidence_threshold,
+                                                                                     class_threshold,
+                                                                                     nms_threshold)
+
+                with stage("track"):
+                    for (timestamp, frame), (boxes_np, confidences_np, index) in zip(batch, filtered):
+                        PlateTracker.update(tracker, timestamp, frame, [boxes_np[i] for i in index],
+                                            [confidences_np[i] for i in index])
+
+            with stage("recognise"):
+                tracks = PlateTracker.pop_finished(tracker, end=finished)
+                if tracks:
+                    plates += ExtractLicencePlatesModel.read_tracks(self, tracks)
+
+        plates.sort(key=lambda plate: (plate['first_seen'], plate['track']))
+
+        return {
             'source_file': "",
-            'plate_detected': plate_detected,
-            'text': extracted_text,
+            'plate_detected': any(plate['text'] != "" for plate in plates),
+            'text': "\n".join(plate['text'] for plate in plates if plate['text'] != ""),
+            'plates': plates,
+            'frames_sampled': frames_sampled,
             'confidence': None,
             'detection_time': (datetime.now() - start_time).total_seconds(),
         }
 
-        return result
+
+# Annotate image with the plate boxes and car reg (the 'plates' of a get_text result)
+def draw_licence_plates(image, plates):
+    for plate in plates:
+        x, y, w, h = plate['box']
+
+        # Plate detection confidence
+        confidence_text = 'plate: {:.0f}%'.format(plate['confidence'] * 100)
+
+        # Highlight plate
+        cv2.rectangle(image, (x, y), (x + w, y + h), (255, 0, 255), 2)
+        cv2.rectangle(image, (x, y - 30), (x + w, y), (255, 0, 255), -1)
+        cv2.rectangle(image, (x, y + h), (x + w, y + h + 25), (0, 0, 0), -1)
+
+        cv2.putText(image, confidence_text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 1)
+        cv2.putText(image, plate['text'], (x, y + h + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 1)
+
+    return image
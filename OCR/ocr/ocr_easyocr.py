@@ -1,7 +1,12 @@
 import easyocr
 from .easyocr_languages import easyocr_languages
+from .layout import reading_order
+from .timing import stage, timed
+from .frame import Frame
 from datetime import datetime
 from pydantic import BaseModel
+from collections import OrderedDict
+import threading
 import numpy as np
 
 class EasyOCR(BaseModel):
@@ -11,99 +16,152 @@ class EasyOCR(BaseModel):
     detection_time: float
 
 
+# Approximate memory held by a reader's detector and recogniser weights, in MB
+def reader_memory(reader):
+    total = 0
+    for network in (getattr(reader, "detector", None), getattr(reader, "recognizer", None)):
+        if network is not None and hasattr(network, "parameters"):
+            total += sum(parameter.numel() * parameter.element_size() for parameter in network.parameters())
+
+    return total / (1024 * 1024)
+
+
+# Keep loaded readers keyed by language set and evict the least recently used one when a limit is reached.
+# A reader is built outside the pool lock (loading takes seconds) under a lock of its own language set, so
+# requests for loaded readers are not held up and each language set is only loaded once at a time
+class ReaderPool:
+    def __init__(self, max_readers=4, max_memory_mb=None):
+        self.max_readers = max_readers
+        self.max_memory_mb = max_memory_mb
+        self.readers = OrderedDict()
+        self.memory = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.loading = {}  # language set -> lock held while its reader is built
+
+    # The pooled reader for key, or None
+    def lookup(self, key):
+        if key not in self.readers:
+            return None
+
+        self.hits += 1
+        self.readers.move_to_end(key)
+        return self.readers[key]
+
+    def get(self, language_codings):
+        key = tuple(sorted(set(language_codings)))
+
+        with self.lock:
+            reader = self.lookup(key)
+            if reader is not None:
+                return reader
+            loading = self.loading.setdefault(key, threading.Lock())
+
+        with loading:
+            # another request may have loaded it while this one waited
+            with self.lock:
+                reader = self.lookup(key)
+                if reader is not None:
+                    return reader
+                self.misses += 1
+
+            try:
+                reader = easyocr.Reader(list(key))
+                # readtext calls these, so requests get detect and recognise timings
+                reader.detect = timed("detect", reader.detect)
+                reader.recognize = timed("recognise", reader.recognize)
+                memory = reader_memory(reader)
+            except BaseException:
+                with self.lock:
+                    self.done_loading(key, loading)
+                raise
+
+            with self.lock:
+                self.readers[key] = reader
+                self.memory[key] = memory
+                self.done_loading(key, loading)
+                self.evict()
+
+            return reader
+
+    # A request that waited on a failed load may be loading the same languages again under a new lock
+    def done_loading(self, key, loading):
+        if self.loading.get(key) is loading:
+            del self.loading[key]
+
+    # Drop least recently used readers until the pool is within its limits, always keeping the newest one
+    def evict(self):
+        while len(self.readers) > 1:
+            over_count = self.max_readers is not None and len(self.readers) > self.max_readers
+            over_memory = self.max_memory_mb is not None and sum(self.memory.values()) > self.max_memory_mb
+            if not over_count and not over_memory:
+                break
+
+            key, _ = self.readers.popitem(last=False)
+            del self.memory[key]
+            self.evictions += 1
+            print("Evicted EasyOCR reader:", key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'readers': ["+".join(key) for key in self.readers],
+                'memory_mb': round(sum(self.memory.values()), 1),
+                'max_readers': self.max_readers,
+                'max_memory_mb': self.max_memory_mb,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
 class EasyOCRModel:
-    # Sort words into the correct order based on x-coordinate and add it to overall text output
-    def add_line_to_extracted_text(line, extracted_text):
-        line = dict(sorted(line.items()))
-        words = ''
-        for word in line.values():
-            words = words + ' ' + word
-
-        extracted_text = extracted_text + words + '\n'
-        
-        return extracted_text
-
-    # Sort words into the correct order
-    def order_words(box, text, extracted_text, prev_y_min, prev_y_max, y_buffer, line):
-        y_max = box[3][1]  # top right coordinate
-        y_min = box[2][1]  # bottom right coordinate
-        x_min = box[0][0]  # bottom left coordinate
-        height_variation = 2  # +/- half of overall height to buffer
-
-        # sort the text into the correct lines based on y-coordinates
-        if (prev_y_min - y_buffer) < y_min and (prev_y_max + y_buffer) > y_max:
-            prev_y_min = y_min
-            y_buffer = (y_max - y_min) / height_variation
-            prev_y_max = y_max
-            line[x_min] = text
-        
-        # Once end of line is reaached add it to the extracted text
-        else:
-            extracted_text = EasyOCRModel.add_line_to_extracted_text(line, extracted_text)
+    def __init__(self, max_readers=4, max_memory_mb=None, preload=None):
+        self.reader_pool = ReaderPool(max_readers, max_memory_mb)
+
+        # Load readers for the chosen languages up front, e.g. preload=["English", "French"]
+        if preload is not None:
+            for language in preload:
+                self.get_reader(language)
 
-            line = {x_min: text}
-            prev_y_min = y_min
-            prev_y_max = y_max
-            y_buffer = (y_max - y_min) / height_variation
+    # Map language names (comma separated for more than one, e.g. "English,French") to a pooled reader
+    def get_reader(self, language):
+        language_options = easyocr_languages()
+        language_codings = [language_options[name.strip()] for name in language.split(",") if name.strip()]
 
-        return extracted_text, prev_y_min, prev_y_max, y_buffer, line
+        return self.reader_pool.get(language_codings)
 
     def get_text(self, image_file_path, language, paragraph):
         start_time = datetime.now()
 
-        # Map language to language coding
-        language_options = easyocr_languages()
-        language_coding = language_options[language]
-
         # Get the boxes, text and confidences for the image
-        reader = easyocr.Reader([language_coding])
-        results = reader.readtext(image_file_path, paragraph=paragraph)
+        reader = self.get_reader(language)
+        results = reader.readtext(Frame.of(image_file_path).bgr, paragraph=paragraph)
 
-        # Sort the words into the correct order
-        line = {}
-        y_buffer = 0
-        prev_y_max = 0
-        prev_y_min = 0
-        extracted_text = ""
-        av_confidence = 0
-        
         # If paragraph == False, confidence scores are generated
         if paragraph is False:
-            count = 0
-            for (box, text, confidence) in results:
-                extracted_text, prev_y_min, prev_y_max, y_buffer, line = EasyOCRModel.order_words(box,
-                                                                                                  text,
-                                                                                                  extracted_text,
-                                                                                                  prev_y_min,
-                                                                                                  prev_y_max,
-                                                                                                  y_buffer,
-                                                                                                  line)
-                av_confidence =+ confidence
-                count =+ 1
-            
+            boxes = [box for (box, text, confidence) in results]
+            texts = [text for (box, text, confidence) in results]
+            confidences = [confidence for (box, text, confidence) in results]
+
             # Check to see if any words were detected
-            try:
-                av_confidence = av_confidence / count
-            except ZeroDivisionError:
-                av_confidence = 0
+            av_confidence = float(np.mean(confidences)) if len(confidences) > 0 else 0
 
-        # Calculate the overall confidence for output
         else:
-            for (box, text) in results: 
-                extracted_text, prev_y_min, prev_y_max, y_buffer, line = EasyOCRModel.order_words(box,
-                                                                                                  text,
-                                                                                                  extracted_text,
-                                                                                                  prev_y_min,
-                                                                                                  prev_y_max,
-                                                                                                  y_buffer,
-                                                                                                  line)
+            boxes = [box for (box, text) in results]
+            texts = [text for (box, text) in results]
             av_confidence = 0.0
 
-        extracted_text = EasyOCRModel.add_line_to_extracted_text(line, extracted_text)
+        # Sort the words into the correct order
+        with stage("order"):
+            layout = reading_order(boxes, texts)
 
         result = {
             'source_file': "",
-            'text': extracted_text,
+            'text': layout['text'],
+            'lines': layout['lines'],
             'confidence': av_confidence,
             'detection_time': (datetime.now() - start_time).total_seconds()
         }
@@ -8,6 +8,9 @@ import tensorflow
 import pickle
 from keras_ocr.detection import build_keras_model
 import string 
+from .layout import reading_order
+from .timing import stage, timed
+from .frame import Frame
 
 
 class Keras(BaseModel):
@@ -27,65 +30,74 @@ class KerasModel:
                                                            weights=None)
         self.recognizer.model.load_weights("./models/keras_recognizer.h5")
 
-    # Sort words into the correct order based on x-coordinate and add it to overall text output
-    def add_line_to_complete(line, extracted_text):
-        line = dict(sorted(line.items()))
-        words = ''
-        for word in line.values():
-            words = words + ' ' + word
+        # Build the pipeline once and reuse it for every request
+        self.pipeline = keras_ocr.pipeline.Pipeline(detector=self.detector, recognizer=self.recognizer)
+
+        # time the detector and recogniser calls the pipeline makes
+        self.detector.detect = timed("detect", self.detector.detect)
+        self.recognizer.recognize_from_boxes = timed("recognise", self.recognizer.recognize_from_boxes)
+
+        # Number of images sent through the detector and recogniser in one forward pass
+        self.batch_size = 8
+
+    # Sort the predicted words into lines
+    def order_prediction(prediction):
+        texts = [text for text, box in prediction]
+        boxes = [box for text, box in prediction]
+
+        with stage("order"):
+            return reading_order(boxes, texts)
 
-        extracted_text = extracted_text + words + '\n'
-        
-        return extracted_text
-    
     def get_text(self, image):
         start_time = datetime.now()
 
-        height_variation = 2  # +/- half of overall height of box to buffer
         # Extract text from input image
-        pipeline = keras_ocr.pipeline.Pipeline(detector=self.detector, recognizer=self.recognizer)
-
-        prediction = pipeline.recognize([image])[0]
+        prediction = self.pipeline.recognize([Frame.of(image).bgr])[0]
         # Annotate input image with boxes
         # fig, ax = plt.subplots()
         # new_image = keras_ocr.tools.drawAnnotations(image=image, predictions=prediction)
         # plt.savefig("./images/annotated_keras.jpg")
-        
-        # Sort words into the correct order
-        line = {}
-        y_buffer = 0
-        prev_y_max = 0
-        prev_y_min = 0
-        extracted_text = ""
-
-        for text, box in prediction: 
-            y_max = box[:, 1].max()  # highest y coordinate
-            y_min = box[:, 1].min()  # lowest y coordinate
-            x_min = box[:, 0].min()  # lowest x coordinate
-
-            # sort the text into the correct lines based on y-coordinates
-            if (prev_y_min - y_buffer) < y_min and (prev_y_max + y_buffer) > y_max:
-                prev_y_min = y_min
-                y_buffer = (y_max - y_min) / height_variation
-                prev_y_max = y_max
-                line[x_min] = text
-                
-            else:
-                extracted_text = KerasModel.add_line_to_complete(line, extracted_text)
-
-                line = {x_min: text}
-
-                prev_y_min = y_min
-                prev_y_max = y_max
-                y_buffer = (y_max - y_min) / height_variation
-
-        extracted_text = KerasModel.add_line_to_complete(line, extracted_text)
+
+        layout = KerasModel.order_prediction(prediction)
 
         result = {
             'source_file': "",
-            'text': extracted_text,
+            'text': layout['text'],
+            'lines': layout['lines'],
             'confidence': None,
             'detection_time': (datetime.now() - start_time).total_seconds()
         }
         
         return result
+
+    # Extract text from many images, running detection and recognition over batches of images at once.
+    # Images of similar size are batched together because the pipeline pads each batch to its largest image
+    def get_text_batch(self, images, batch_size=None):
+        start_time = datetime.now()
+        batch_size = batch_size or self.batch_size
+        images = [Frame.of(image).bgr for image in images]
+
+        order = sorted(range(len(images)), key=lambda i: images[i].shape[:2])
+        predictions = [None] * len(images)
+
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            batch_predictions = self.pipeline.recognize([images[i] for i in batch])
+
+            for i, prediction in zip(batch, batch_predictions):
+                predictions[i] = prediction
+
+        detection_time = (datetime.now() - start_time).total_seconds()
+
+        results = []
+        for prediction in predictions:
+            layout = KerasModel.order_prediction(prediction)
+            results.append({
+                'source_file': "",
+                'text': layout['text'],
+                'lines': layout['lines'],
+                'confidence': None,
+                'detection_time': detection_time / max(len(images), 1)
+            })
+
+        return results
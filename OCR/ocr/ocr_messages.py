@@ -2,11 +2,12 @@ import os
 import easyocr
 import cv2
 import numpy as np
-import plotly.express as px
 from pydantic import BaseModel
 from datetime import datetime
-from ultralytics import YOLO
 from PIL import Image
+from .yolo import make_blob, filter_detections, YoloDetector
+from .timing import stage
+from .frame import Frame
 class ExtractMessages(BaseModel):
     source_file: str
     message_detected: bool
@@ -17,7 +18,9 @@ class ExtractMessages(BaseModel):
 
 # Extract message boxes from images and get the text
 class ExtractMessagesModel:
-    def __init__(self):
+    # backend is "ultralytics" (the .pt model), "onnxruntime" or "opencv" (the exported .onnx model).
+    # The threads only apply to ONNX Runtime
+    def __init__(self, backend="ultralytics", intra_op_threads=0, inter_op_threads=0):
         # Load recogniser model
         self.reader = easyocr.Reader(['en'])
 
@@ -25,8 +28,19 @@ class ExtractMessagesModel:
         self.INPUT_WIDTH = 640 
         self.INPUT_HEIGHT = 640
         self.CLASSES = ['android', 'facebook', 'group', 'hangouts', 'imessage', 'instagram', 'line', 'received', 'sent', 'signal', 'skype', 'snapchat', 'telegram', 'twitter', 'wechat', 'whatsapp']
+        # ultralytics defaults for detection
+        self.CONFIDENCE_THRESHOLD = 0.25
+        self.NMS_THRESHOLD = 0.7
+
         # Load detector model
-        self.model = YOLO("./models/message_detector.pt")
+        self.backend = backend
+        if backend == "ultralytics":
+            from ultralytics import YOLO
+            self.model = YOLO("./models/message_detector.pt")
+        else:
+            if not os.path.exists("./models/message_detector.onnx"):
+                export_message_detector()
+            self.model = YoloDetector("./models/message_detector.onnx", backend, intra_op_threads, inter_op_threads)
 
 
     # Order messages with top messages first and bottom messages last
@@ -47,14 +61,37 @@ class ExtractMessagesModel:
 
     # Locate message boxes
     def detect_messages(self, input_image):
+        if self.backend == "ultralytics":
+            predictions = self.model(input_image)
+            message_coordinates = list(predictions)[0].boxes.xyxy.cpu().tolist()
+            class_values = list(predictions)[0].boxes.cls.cpu().tolist()
+            class_confidence= list(predictions)[0].boxes.conf.cpu().tolist()
+        else:
+            message_coordinates, class_values, class_confidence = \
+                ExtractMessagesModel.detect_messages_onnx(self, input_image)
 
-        predictions = self.model(input_image)
-        message_coordinates = list(predictions)[0].boxes.xyxy.cpu().tolist()
-        class_values = list(predictions)[0].boxes.cls.cpu().tolist()
-        class_confidence= list(predictions)[0].boxes.conf.cpu().tolist()
         message_coordinates, class_values, class_confidence = ExtractMessagesModel.order_messages(message_coordinates, class_values, class_confidence)
         return message_coordinates, class_values, class_confidence
 
+    # Locate message boxes with the exported model, using the same pre- and post-processing as the plate detector.
+    # Returns [x0, y0, x1, y1] boxes clipped to the image, like ultralytics
+    def detect_messages_onnx(self, input_image):
+        input_images, blob, factors = make_blob([input_image], self.INPUT_WIDTH)
+        predictions = YoloDetector.forward(self.model, blob)
+        boxes, confidences, index, class_ids = filter_detections(predictions, factors, self.CONFIDENCE_THRESHOLD,
+                                                                 self.CONFIDENCE_THRESHOLD, self.NMS_THRESHOLD,
+                                                                 with_classes=True)[0]
+
+        rows, columns = input_image.shape[:2]
+        message_coordinates = []
+        for i in index:
+            x, y, w, h = boxes[i]
+            message_coordinates.append([max(x, 0), max(y, 0), min(x + w, columns), min(y + h, rows)])
+        class_values = [class_ids[i] for i in index]
+        class_confidence = [confidences[i] for i in index]
+
+        return message_coordinates, class_values, class_confidence
+
     # Filter boxes based on confidence and probability scores
     def filter_message_coords(self, message_coordinates, class_values, class_confidence):
         boxes = []
@@ -94,17 +131,18 @@ class ExtractMessagesModel:
         
         return extracted_text
 
-    # Annotate input image with boxes and car reg
-    def annotate_image(self, image, message_coords, confidences_np, names):
+    # Read the text of every message box and put the conversation together
+    def read_messages(self, image, message_coords, confidences_np, names):
         message_detected = True
         app = "Unknown"
         all_text = ""
-        message_array = []
+        messages = []
         print(names)
         # for each message detected
         for i in range(len(names)):
             message_text = ExtractMessagesModel.extract_text(self, image, message_coords[i])
-            message_array.append(message_text)
+            messages.append({'box': message_coords[i], 'confidence': confidences_np[i], 'name': names[i],
+                             'text': message_text})
             if names[i] == "sent" or names[i] == "received":
                 print("m ", message_text)
                 all_text = all_text + "\n" + names[i] + ": " + message_text
@@ -114,28 +152,10 @@ class ExtractMessagesModel:
                 app = names[i]
 
         print(all_text)
-        if all_text != "":
-            for i in range(len(names)):
-                # message detection confidence
-                message_confidence = confidences_np[i]
-                confidence_text = names[i] + ": " + str((message_confidence * 100))[:5]
-                x0, y0, x1, y1 = message_coords[i]
-                x0 = int(x0)
-                y0 = int(y0)
-                x1 = int(x1)
-                y1 = int(y1)
-
-                cv2.rectangle(image, (x0, y0), (x1, y1), (30, 144, 250), 2)
-                cv2.rectangle(image, (x0, y0 - 30), (x1, y0), (30, 144, 250), -1)
-                cv2.rectangle(image, (x0, y1), (x1, y1 + 25), (0, 0, 0), -1)
-
-                # Draw message
-                cv2.putText(image, confidence_text, (x0, y0 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.65, (255, 255, 255), 2)
-                cv2.putText(image, message_array[i], (x0, y1 + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.65, (0, 255, 0), 1)
-
         if all_text == "":
             print("no coords")
             message_detected = False
+            messages = []
 
             results = self.reader.readtext(image, paragraph=True)
 
@@ -143,52 +163,74 @@ class ExtractMessagesModel:
                 all_text = all_text + text + "\n"
 
 
-        return image, all_text, message_detected, app
+        return messages, all_text, message_detected, app
 
     # Detect car message  and extract text
     def get_text(self, img):
         start_time = datetime.now()
 
-        # convert PIL to OpenCV
-        pil_image = img.convert("RGB")
-        open_cv_image = np.array(pil_image)
-        img = open_cv_image[:, :, ::-1].copy()
+        # BGR pixels of the frame, PIL image or array
+        img = Frame.of(img).bgr
 
 
         # detect message
-        message_coordinates, class_values, class_confidence = ExtractMessagesModel.detect_messages(self, img)
-        # filter message  coordinates
-        filtered_coords, confindences, names = \
-            ExtractMessagesModel.filter_message_coords(self,
-                                                            message_coordinates,
-                                                            class_values,
-                                                            class_confidence)
-        # annotate_image
-        annotated_image, extracted_text, message_detected, app = \
-            ExtractMessagesModel.annotate_image(self,
-                                                     img,
-                                                     filtered_coords,
-                                                     confindences,
-                                                     names)
+        with stage("detect"):
+            message_coordinates, class_values, class_confidence = ExtractMessagesModel.detect_messages(self, img)
+            # filter message  coordinates
+            filtered_coords, confindences, names = \
+                ExtractMessagesModel.filter_message_coords(self,
+                                                                message_coordinates,
+                                                                class_values,
+                                                                class_confidence)
+        # read the messages
+        with stage("recognise"):
+            messages, extracted_text, message_detected, app = \
+                ExtractMessagesModel.read_messages(self,
+                                                   img,
+                                                   filtered_coords,
+                                                   confindences,
+                                                   names)
 
         print("\n\n\n\n"+extracted_text)
-        fig = px.imshow(annotated_image)
-        fig.update_layout(width=1400, height=800, margin=dict(l=10, r=10, b=10, t=10))
-        fig.update_xaxes(showticklabels=False).update_yaxes(showticklabels=False)
-        fig.show()
-        fig.write_image("plotly.png")
 
         result = {
             'source_file': "",
             'message_detected': message_detected,
             'app': app,
             'text': extracted_text,
+            'messages': messages,
             'confidence': None,
             'detection_time': (datetime.now() - start_time).total_seconds(),
         }
 
         return result
 
+
+# Export the ultralytics message detector to ONNX with a dynamic batch size, for the onnxruntime and opencv
+# backends. Writes ./models/message_detector.onnx
+def export_message_detector(weights="./models/message_detector.pt", imgsz=640):
+    from ultralytics import YOLO
+
+    return YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True)
+
+
+# Annotate image with the message boxes and their text (the 'messages' of a get_text result)
+def draw_messages(image, messages):
+    for message in messages:
+        # message detection confidence
+        confidence_text = message['name'] + ": " + str((message['confidence'] * 100))[:5]
+        x0, y0, x1, y1 = [int(coordinate) for coordinate in message['box']]
+
+        cv2.rectangle(image, (x0, y0), (x1, y1), (30, 144, 250), 2)
+        cv2.rectangle(image, (x0, y0 - 30), (x1, y0), (30, 144, 250), -1)
+        cv2.rectangle(image, (x0, y1), (x1, y1 + 25), (0, 0, 0), -1)
+
+        # Draw message
+        cv2.putText(image, confidence_text, (x0, y0 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.65, (255, 255, 255), 2)
+        cv2.putText(image, message['text'], (x0, y1 + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.65, (0, 255, 0), 1)
+
+    return image
+
 # model = ExtractMessagesModel()
 #
 # img = Image.open("/home/iduadmin/Downloads/telegram_chat.png")
@@ -1,7 +1,15 @@
 from pytesseract import pytesseract
+import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import cv2
+import numpy as np
 from pydantic import BaseModel
 from datetime import datetime
+from .timing import stage
+from .frame import Frame
+from .layout import reading_order
 
 class Tesseract(BaseModel):
     source_file: str
@@ -10,20 +18,231 @@ class Tesseract(BaseModel):
     detection_time: float
 
 
+# One initialised Tesseract engine (tesserocr) per worker thread, so the traineddata is loaded once per thread
+# and requests in different threads recognise in parallel (tesserocr releases the GIL)
+class TesseractAPIPool:
+    def __init__(self, tessdata_path=None, language="eng"):
+        import tesserocr
+
+        self.tesserocr = tesserocr
+        self.tessdata_path = tessdata_path
+        self.language = language
+        self.local = threading.local()
+        self.apis = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        api = getattr(self.local, "api", None)
+        if api is None:
+            if self.tessdata_path is None:
+                api = self.tesserocr.PyTessBaseAPI(lang=self.language)
+            else:
+                api = self.tesserocr.PyTessBaseAPI(path=self.tessdata_path, lang=self.language)
+            self.local.api = api
+
+            with self.lock:
+                self.apis.append(api)
+
+        return api
+
+    def close(self):
+        with self.lock:
+            for api in self.apis:
+                api.End()
+            self.apis = []
+
+    def stats(self):
+        with self.lock:
+            return {'engines': len(self.apis), 'language': self.language}
+
+
+# Split a grey page into up to bands horizontal bands for tiled recognition. Each cut is moved to the row with
+# the least ink near its ideal position, so it normally falls between lines of text. Returns
+# (own_top, own_bottom, top, bottom) for every band: the rows it is responsible for and the rows it reads,
+# which reach overlap pixels into its neighbours so that a line cut through is still read whole by one of them
+def split_bands(gray, bands, overlap):
+    height = gray.shape[0]
+    band_height = height / bands
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    row_ink = ink.sum(axis=1)
+
+    cuts = [0]
+    for n in range(1, bands):
+        ideal = int(round(band_height * n))
+        low, high = max(cuts[-1] + 1, ideal - int(band_height / 4)), min(height - 1, ideal + int(band_height / 4))
+        if high < low:
+            cuts.append(ideal)
+            continue
+
+        # of the rows with the least ink, the one nearest the ideal cut
+        window = row_ink[low:high + 1]
+        rows = low + np.flatnonzero(window == window.min())
+        cuts.append(int(rows[np.argmin(np.abs(rows - ideal))]))
+    cuts.append(height)
+
+    return [(own_top, own_bottom, max(0, own_top - overlap), min(height, own_bottom + overlap))
+            for own_top, own_bottom in zip(cuts[:-1], cuts[1:])]
+
+
+tile_model = None
+
+
+# Tile pool worker set-up: each worker process loads its own engine once. The workers come from a forkserver,
+# so they start clean instead of inheriting the server's threads, locks and tesserocr handles
+def init_tile_worker(backend, tesseract_cmd, tessdata_path, language):
+    global tile_model
+    tile_model = TesseractModel(backend, tesseract_cmd, tessdata_path, language, tile_workers=1)
+
+
+def recognise_tile(tile):
+    return TesseractModel.recognise_words(tile_model, tile)
+
+
 class TesseractModel:
-    def init(self):
-        # path to tesseract on ubuntu
-        pytesseract.pytesseract.tesseract_cmd = r"/usr/share/tesseract-ocr/4.00/tessdata"
-        
-    def get_text(self, img, scale):
+    # backend is "api" (in-process engines from TesseractAPIPool, with word boxes and confidences) or
+    # "subprocess" (pytesseract, one tesseract process per request).
+    # tile_workers is the size of the process pool for tiled recognition (default one per core)
+    def __init__(self, backend="subprocess", tesseract_cmd="tesseract", tessdata_path=None, language="eng",
+                 tile_workers=None, tile_overlap=48, min_band_height=300):
+        # path to the tesseract executable for the subprocess backend
+        pytesseract.tesseract_cmd = tesseract_cmd
+
+        self.backend = backend
+        self.tesseract_cmd = tesseract_cmd
+        self.tessdata_path = tessdata_path
+        self.language = language
+        # the subprocess backend reads the same language and traineddata as the api backend
+        self.config = '--tessdata-dir "{}"'.format(tessdata_path) if tessdata_path else ""
+        self.tile_workers = tile_workers or os.cpu_count()
+        self.tile_overlap = tile_overlap  # pixels at scale 1
+        self.min_band_height = min_band_height  # pixels at scale 1
+        self.tile_pool = None
+        self.tile_pool_lock = threading.Lock()
+        self.api_pool = None
+        if backend == "api":
+            self.api_pool = TesseractAPIPool(tessdata_path, language)
+        elif backend != "subprocess":
+            raise ValueError("Unknown Tesseract backend: {}".format(backend))
+
+    # Recognise a grey image with this thread's engine. Returns the text and every word with its
+    # [x0, y0, x1, y1] box and confidence (0 to 1)
+    def recognise_api(self, gray):
+        api = self.api_pool.get()
+        gray = np.ascontiguousarray(gray)
+        height, width = gray.shape
+
+        # the engine goes back to the pool with no image loaded, even when recognition fails
+        try:
+            api.SetImageBytes(gray.tobytes(), width, height, 1, width)
+            api.Recognize()
+            text = api.GetUTF8Text()
+
+            words = []
+            level = self.api_pool.tesserocr.RIL.WORD
+            for word in self.api_pool.tesserocr.iterate_level(api.GetIterator(), level):
+                word_text = word.GetUTF8Text(level)
+                if word_text:
+                    words.append({'text': word_text, 'box': list(word.BoundingBox(level)),
+                                  'confidence': word.Confidence(level) / 100})
+        finally:
+            api.Clear()
+
+        return text, words
+
+    # Words of an image with [x0, y0, x1, y1] boxes and confidences (0 to 1), with either backend
+    def recognise_words(self, img):
+        if self.backend == "api":
+            return TesseractModel.recognise_api(self, img)[1]
+
+        data = pytesseract.image_to_data(img, lang=self.language, config=self.config,
+                                         output_type=pytesseract.Output.DICT)
+        words = []
+        for text, confidence, x, y, w, h in zip(data['text'], data['conf'], data['left'], data['top'],
+                                                 data['width'], data['height']):
+            if text.strip() and float(confidence) >= 0:
+                words.append({'text': text, 'box': [x, y, x + w, y + h], 'confidence': float(confidence) / 100})
+
+        return words
+
+    def get_tile_pool(self):
+        with self.tile_pool_lock:
+            if self.tile_pool is None:
+                self.tile_pool = ProcessPoolExecutor(
+                    self.tile_workers, mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=init_tile_worker,
+                    initargs=(self.backend, self.tesseract_cmd, self.tessdata_path, self.language))
+
+        return self.tile_pool
+
+    # Recognise a page as horizontal bands in parallel across the tile pool and stitch the words back together.
+    # Every band keeps only the words whose centre lies in its own rows, so words read twice in an overlap
+    # are counted once, then the words are put back in reading order
+    def get_text_tiled(self, img, scale):
+        start_time = datetime.now()
+
+        gray = Frame.of(img).gray
+        if scale != 1:
+            height, width = gray.shape[:2]
+            gray = cv2.resize(gray, ((width * scale), (height * scale)))
+
+        bands = max(1, min(self.tile_workers, gray.shape[0] // (self.min_band_height * scale)))
+        with stage("detect"):
+            tiles = split_bands(gray, bands, self.tile_overlap * scale)
+
+        with stage("recognise"):
+            if len(tiles) == 1:
+                tile_words = [TesseractModel.recognise_words(self, gray)]
+            else:
+                pool = TesseractModel.get_tile_pool(self)
+                tile_words = list(pool.map(recognise_tile, [gray[top:bottom] for _, _, top, bottom in tiles]))
+
+        with stage("order"):
+            words = []
+            for (own_top, own_bottom, top, _), found in zip(tiles, tile_words):
+                for word in found:
+                    x0, y0, x1, y1 = word['box']
+                    if own_top <= top + (y0 + y1) / 2 < own_bottom:
+                        word['box'] = [x0 / scale, (y0 + top) / scale, x1 / scale, (y1 + top) / scale]
+                        words.append(word)
+
+            ordered = reading_order([word['box'] for word in words], [word['text'] for word in words])
+            words = [words[n] for n in ordered['order']]
+
+        return {
+            'source_file': "",
+            'text': ordered['text'],
+            'confidence': float(np.mean([word['confidence'] for word in words])) if words else 0.0,
+            'detection_time': (datetime.now() - start_time).total_seconds(),
+            'words': words,
+            'tiles': len(tiles)
+        }
+
+    def close(self):
+        if self.tile_pool is not None:
+            self.tile_pool.shutdown()
+        if self.api_pool is not None:
+            self.api_pool.close()
+
+    def get_text(self, img, scale, tiled=False):
+        if tiled:
+            return TesseractModel.get_text_tiled(self, img, scale)
+
         start_time = datetime.now()
 
         # Scale image
-        height, width, channels = img.shape
-        img = cv2.resize(img, ((height * scale), (width * scale)))
-        
+        frame = Frame.of(img)
+        img = frame.gray if self.backend == "api" else frame.bgr
+        if scale != 1:
+            height, width = img.shape[:2]
+            img = cv2.resize(img, ((width * scale), (height * scale)))
+
         # Extract text
-        text = pytesseract.image_to_string(img)
+        with stage("recognise"):
+            if self.backend == "api":
+                text, words = TesseractModel.recognise_api(self, img)
+            else:
+                text = pytesseract.image_to_string(img, lang=self.language, config=self.config)
+                words = None
 
         result = {
             'source_file': "",
@@ -31,4 +250,12 @@ class TesseractModel:
             'confidence': None,
             'detection_time': (datetime.now() - start_time).total_seconds()
         }
+
+        if words is not None:
+            # boxes in the coordinates of the image that was sent
+            for word in words:
+                word['box'] = [coordinate / scale for coordinate in word['box']]
+            result['words'] = words
+            result['confidence'] = float(np.mean([word['confidence'] for word in words])) if words else 0.0
+
         return result
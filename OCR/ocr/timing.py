@@ -0,0 +1,43 @@
+# Per-request stage timings (read, decode, pre_process, classify, detect, recognise, order, annotate, serialise).
+# The current request's timings live in a context variable, so the engines can record stages without the
+# timings being passed through every call. Outside a request nothing is recorded
+import contextvars
+import functools
+from contextlib import contextmanager
+from time import perf_counter
+
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+# Start collecting stage timings for the current request, and any work it hands to the worker threads
+def start_timings():
+    timings = {}
+    current_timings.set(timings)
+
+    return timings
+
+
+def add_stage(name, seconds):
+    timings = current_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + seconds
+
+
+# Time the enclosed block as a stage. A stage that runs more than once in a request is summed
+@contextmanager
+def stage(name):
+    start_time = perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, perf_counter() - start_time)
+
+
+# Wrap a function so that every call is timed as the stage
+def timed(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return function(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,139 @@
+# Frame sampling and box tracking for reading licence plates in videos
+import cv2
+import numpy as np
+from collections import Counter
+
+
+# Decode a video file as a stream and yield (timestamp in seconds, BGR frame) for sample_fps frames a second
+# (every frame if sample_fps is 0), stopping after max_frames sampled frames. Skipped frames are only grabbed,
+# not converted
+def sample_frames(path, sample_fps=5, max_frames=None):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("Cannot read the video")
+
+    try:
+        video_fps = capture.get(cv2.CAP_PROP_FPS) or 25
+        step = 1 if sample_fps <= 0 else max(1, round(video_fps / sample_fps))
+
+        number, sampled = 0, 0
+        while capture.grab():
+            if number % step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    yield number / video_fps, frame
+                    sampled += 1
+                    if max_frames is not None and sampled >= max_frames:
+                        break
+            number += 1
+    finally:
+        capture.release()
+
+
+# Intersection over union of two [x, y, w, h] boxes
+def iou(a, b):
+    width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0
+
+    intersection = width * height
+    return intersection / (a[2] * a[3] + b[2] * b[3] - intersection)
+
+
+class Track:
+    def __init__(self, track_id, timestamp, box, confidence):
+        self.track_id = track_id
+        self.box = box
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.frames = 0
+        self.best_confidence = confidence
+        self.candidates = []  # (score, timestamp, box, crop), the best few crops to read
+
+
+# Follows plates from frame to frame by matching each detection to the track whose last box overlaps it most.
+# A track ends when it has not been seen for max_missed seconds. Each track keeps its reads best crops (by
+# detection confidence and size), so the recogniser only runs that many times per plate
+class PlateTracker:
+    def __init__(self, iou_threshold=0.3, max_missed=1.0, reads=2):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.reads = reads
+        self.active = []
+        self.finished = []
+        self.next_id = 1
+
+    def update(self, timestamp, frame, boxes, confidences):
+        pairs = sorted(((iou(track.box, box), t, d) for t, track in enumerate(self.active)
+                        for d, box in enumerate(boxes)), reverse=True)
+
+        matched_tracks, matched_boxes = set(), set()
+        for overlap, t, d in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            PlateTracker.extend(self, self.active[t], timestamp, frame, boxes[d], confidences[d])
+
+        for d, box in enumerate(boxes):
+            if d not in matched_boxes:
+                track = Track(self.next_id, timestamp, box, confidences[d])
+                self.next_id += 1
+                PlateTracker.extend(self, track, timestamp, frame, box, confidences[d])
+                self.active.append(track)
+
+        # tracks not seen for too long are done
+        still_active = []
+        for track in self.active:
+            if timestamp - track.last_seen > self.max_missed:
+                self.finished.append(track)
+            else:
+                still_active.append(track)
+        self.active = still_active
+
+    def extend(self, track, timestamp, frame, box, confidence):
+        track.box = box
+        track.last_seen = timestamp
+        track.frames += 1
+        track.best_confidence = max(track.best_confidence, confidence)
+
+        score = confidence * box[2] * box[3]
+        if len(track.candidates) < self.reads or score > track.candidates[-1][0]:
+            x, y, w, h = box
+            rows, columns = frame.shape[:2]
+            crop = frame[max(y, 0):min(y + h, rows), max(x, 0):min(x + w, columns)].copy()
+            track.candidates = sorted(track.candidates + [(score, timestamp, box, crop)],
+                                      key=lambda candidate: -candidate[0])[:self.reads]
+
+    # Finished tracks, emptied from the tracker (all of them at the end of the video)
+    def pop_finished(self, end=False):
+        if end:
+            self.finished += self.active
+            self.active = []
+
+        finished, self.finished = self.finished, []
+        return finished
+
+
+def normalise_plate(text):
+    return "".join(text.split()).upper()
+
+
+# Merge the reads of one plate. With reads of the same length each character is voted on separately,
+# otherwise the most common read wins (the earliest, i.e. best crop, on a tie)
+def vote(texts):
+    texts = [normalise_plate(text) for text in texts if normalise_plate(text)]
+    if len(texts) == 0:
+        return "", 0.0
+
+    if len(set(len(text) for text in texts)) == 1:
+        voted = "".join(Counter(characters).most_common(1)[0][0] for characters in zip(*texts))
+    else:
+        counts = Counter(texts)
+        voted = max(texts, key=lambda text: counts[text])
+
+    agreement = float(np.mean([text == voted for text in texts]))
+    return voted, agreement
@@ -0,0 +1,168 @@
+# Shared pre- and post-processing for the YOLO detectors
+import cv2
+import numpy as np
+
+
+# Pad the image with black to a square so it keeps its aspect ratio when resized to the model input
+def pad_to_square(image):
+    rows, columns = image.shape[:2]
+
+    max_rc = max(rows, columns)
+    input_image = np.zeros((max_rc, max_rc, 3), dtype=np.uint8)
+    input_image[0:rows, 0:columns] = image[:, :, :3]
+
+    return input_image
+
+
+# Pad the images to squares and scale them into one NCHW RGB blob for the detector.
+# Returns the padded images, the blob and the factor that scales model coordinates back to each padded image
+def make_blob(images, size=640):
+    input_images = [pad_to_square(image) for image in images]
+
+    # 1/255 = scale factor
+    blob = cv2.dnn.blobFromImages(input_images, 1 / 255, (size, size), swapRB=True, crop=False)
+    factors = [input_image.shape[0] / size for input_image in input_images]
+
+    return input_images, blob, factors
+
+
+# YOLOv8 exports are (images, 4 + classes, anchors) without an objectness column. Turn them into YOLOv5 style
+# rows (images, anchors, 5 + classes), using the best class score as the confidence. YOLOv5 output is unchanged
+def to_yolov5_rows(output):
+    output = np.asarray(output)
+    if output.ndim == 2:
+        output = output[None]
+
+    if output.shape[1] < output.shape[2]:
+        output = output.transpose(0, 2, 1)
+        scores = output[..., 4:]
+        output = np.concatenate([output[..., :4], scores.max(axis=-1, keepdims=True), scores], axis=-1)
+
+    return output
+
+
+# Batch size an ONNX model was exported with, or None if its batch dimension is dynamic. Without the onnx package
+# the graph cannot be read, so the model is taken to accept one image at a time
+def onnx_batch_size(path):
+    try:
+        import onnx
+    except ImportError:
+        return 1
+
+    graph = onnx.load(path, load_external_data=False).graph
+    initializers = set(initializer.name for initializer in graph.initializer)
+    model_input = [graph_input for graph_input in graph.input if graph_input.name not in initializers][0]
+    dimension = model_input.type.tensor_type.shape.dim[0]
+
+    return dimension.dim_value if dimension.HasField("dim_value") and dimension.dim_value > 0 else None
+
+
+# Runs a YOLO ONNX model on a blob from make_blob, with OpenCV's dnn module or ONNX Runtime.
+# For ONNX Runtime, 0 threads lets it pick the number of cores
+class YoloDetector:
+    def __init__(self, path, backend="opencv", intra_op_threads=0, inter_op_threads=0):
+        self.backend = backend
+
+        if backend == "opencv":
+            self.model = cv2.dnn.readNetFromONNX(path)
+            self.model.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.model.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+            # models exported with a fixed batch size (e.g. 1) take the images that many at a time
+            self.batch_size = onnx_batch_size(path)
+
+        elif backend == "onnxruntime":
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = intra_op_threads
+            options.inter_op_num_threads = inter_op_threads
+            if inter_op_threads > 1:
+                options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+
+            self.model = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            self.input_name = self.model.get_inputs()[0].name
+
+            # models exported with a fixed batch size take the images that many at a time
+            batch_size = self.model.get_inputs()[0].shape[0]
+            self.batch_size = batch_size if isinstance(batch_size, int) else None
+
+        else:
+            raise ValueError("Unknown detector backend: {}".format(backend))
+
+    def forward(self, blob):
+        if self.batch_size is not None and len(blob) != self.batch_size:
+            return np.concatenate([YoloDetector.forward(self, blob[start:start + self.batch_size])
+                                   for start in range(0, len(blob), self.batch_size)])
+
+        if self.backend == "opencv":
+            self.model.setInput(blob)
+            return self.model.forward()
+
+        return self.model.run(None, {self.input_name: blob})[0]
+
+
+# Decode raw YOLO rows (center x, center y, width, height, confidence, class scores...) for a batch of images.
+# detections has shape (images, rows, columns) and factors the scale from model input to each padded image.
+# Returns the image index, [left, top, width, height] box, confidence and class of every row above the thresholds
+def decode_detections(detections, factors, confidence_threshold=0.4, class_threshold=0.25):
+    detections = np.asarray(detections)
+    factors = np.asarray(factors, dtype=np.float64).reshape(-1)
+
+    keep = (detections[..., 4] > confidence_threshold) & (detections[..., 5:].max(axis=-1) > class_threshold)
+    image_index, row_index = np.nonzero(keep)
+    rows = detections[image_index, row_index]
+
+    factor = factors[image_index][:, None]
+    centres = rows[:, 0:2].astype(np.float64)
+    sizes = rows[:, 2:4].astype(np.float64)
+    boxes = np.concatenate([(centres - 0.5 * sizes) * factor, sizes * factor], axis=1).astype(np.int64)
+
+    return image_index, boxes, rows[:, 4].astype(np.float64), rows[:, 5:].argmax(axis=-1)
+
+
+# Non-maximum suppression, returning the indices of the boxes to keep as a flat array.
+# With class_ids, only boxes of the same class suppress each other
+def non_max_suppression(boxes, confidences, score_threshold=0.25, nms_threshold=0.45, class_ids=None):
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    boxes = np.asarray(boxes)
+    if class_ids is not None:
+        # move each class to its own area so boxes of different classes never overlap
+        offsets = np.asarray(class_ids)[:, None] * (boxes[:, :2].max() + boxes[:, 2:].max() + 1)
+        boxes = np.concatenate([boxes[:, :2] + offsets, boxes[:, 2:]], axis=1)
+
+    index = cv2.dnn.NMSBoxes(boxes.tolist(), np.asarray(confidences).tolist(), score_threshold, nms_threshold)
+    return np.array(index, dtype=np.int64).reshape(-1)
+
+
+# Decode and suppress the detections of every image in a batch (YOLOv5 or YOLOv8 output).
+# Returns one (boxes, confidences, index) tuple per image, with boxes and confidences as lists.
+# With with_classes=True the class of each box is added as a fourth list and NMS is done per class.
+# confidence_threshold is the only cutoff on the confidence (NMS uses it too); class_threshold applies to
+# the best class score
+def filter_detections(detections, factors, confidence_threshold=0.4, class_threshold=0.25, nms_threshold=0.45,
+                      with_classes=False):
+    detections = to_yolov5_rows(detections)
+
+    image_index, boxes, confidences, class_ids = decode_detections(detections, factors, confidence_threshold,
+                                                                   class_threshold)
+
+    results = []
+    for image in range(len(detections)):
+        selected = image_index == image
+        image_boxes = boxes[selected]
+        image_confidences = confidences[selected]
+
+        if with_classes:
+            image_classes = class_ids[selected]
+            index = non_max_suppression(image_boxes, image_confidences, confidence_threshold, nms_threshold,
+                                        image_classes)
+            results.append((image_boxes.tolist(), image_confidences.tolist(), index, image_classes.tolist()))
+        else:
+            index = non_max_suppression(image_boxes, image_confidences, confidence_threshold, nms_threshold)
+            results.append((image_boxes.tolist(), image_confidences.tolist(), index))
+
+    return results
@@ -2,6 +2,8 @@ import numpy as np
 from PIL import Image
 from scipy.ndimage import interpolation as inter
 import cv2
+from datetime import datetime
+from ocr.frame import Frame
 
 # Get a score for each angle tested
 def find_score(arr, angle):
@@ -11,53 +13,152 @@ def find_score(arr, angle):
     return hist, score
 
 
-# Straighten image
-def skew_correction(image_file_path):
-    # convert to binary
-    img = Image.open(image_file_path)
+# Score every angle at once from the coordinates of the foreground pixels: each pixel is projected onto
+# the rotated row axis and binned, so no rotated copy of the image is ever made
+def projection_scores(binary, angles, chunk_size=32):
+    ys, xs = np.nonzero(binary)
+    scores = np.zeros(len(angles))
+    if len(ys) == 0:
+        return scores
+
+    centre_y = binary.shape[0] / 2
+    centre_x = binary.shape[1] / 2
+    ys = ys - centre_y
+    xs = xs - centre_x
+    radius = int(np.ceil(np.hypot(centre_y, centre_x))) + 1
+    bins = 2 * radius + 2
+    length = chunk_size * bins
+
+    radians = np.deg2rad(angles)
+    for start in range(0, len(angles), chunk_size):
+        chunk = radians[start:start + chunk_size]
+        offsets = (np.arange(len(chunk)) * bins)[:, None]
+
+        # row of each pixel after rotating the image by each angle, split between the two nearest bins so
+        # that the pixel grid does not alias into the histogram at diagonal angles
+        rows = np.outer(np.cos(chunk), ys) - np.outer(np.sin(chunk), xs) + radius
+        lower = np.floor(rows)
+        upper_weight = (rows - lower).ravel()
+        lower = (lower.astype(np.int64) + offsets).ravel()
+
+        hist = np.bincount(lower, weights=1 - upper_weight, minlength=length)
+        hist += np.bincount(lower + 1, weights=upper_weight, minlength=length)
+        hist = hist.reshape(chunk_size, bins)[:len(chunk)]
+
+        scores[start:start + len(chunk)] = np.sum(np.diff(hist, axis=1) ** 2, axis=1)
+
+    return scores
+
+
+# Pick the highest scoring angle, preferring the smallest rotation when scores tie (e.g. 0 and 180 degrees)
+def best_angle(angles, scores):
+    candidates = np.flatnonzero(scores >= scores.max() * (1 - 1e-9))
+    return float(angles[candidates[np.argmin(np.abs(angles[candidates]))]])
+
+
+# Shrink the image so its longest side is at most max_size and binarise it with text as foreground
+def binarise_for_skew(gray, max_size):
+    scale = min(1.0, max_size / max(gray.shape[:2]))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary
+
+
+# Estimate the skew angle: search whole degrees on a small copy, then refine around the best angle at a
+# higher resolution to a fraction of a degree
+def estimate_skew(img, limit=180, coarse_step=1.0, fine_step=0.1, coarse_size=512, fine_size=1600):
+    start_time = datetime.now()
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    coarse = binarise_for_skew(gray, coarse_size)
+    angles = np.arange(-limit, limit + coarse_step, coarse_step)
+    angle = best_angle(angles, projection_scores(coarse, angles))
+
+    fine = binarise_for_skew(gray, fine_size)
+    angles = angle + np.arange(-coarse_step, coarse_step + fine_step / 2, fine_step)
+    angle = best_angle(angles, projection_scores(fine, angles))
+
+    return {
+        'angle': round(angle, 2) + 0.0,
+        'method': "coarse_to_fine",
+        'detection_time': (datetime.now() - start_time).total_seconds()
+    }
+
+
+# Original estimate: rotate the full image by every whole degree and score it. Kept for comparison
+# (tests/test_pre_processor.py checks that both estimates agree). A rotation by 180 degrees scores the same,
+# so ties go to the smaller rotation as in estimate_skew rather than to the first angle tried
+def estimate_skew_exhaustive(img, limit=180):
+    start_time = datetime.now()
 
     delta = 1
-    limit = 180  # max rotation allowed
     angles = np.arange(-limit, limit + delta, delta)
     scores = []
     for angle in angles:
         hist, score = find_score(img, angle)
         scores.append(score)
 
-    best_score = max(scores)
-    best_angle = angles[scores.index(best_score)]
-    print('Best angle: {}'.format(best_angle))
-    img_g = cv2.imread(image_file_path)
+    return {
+        'angle': best_angle(angles, np.array(scores, dtype=np.float64)),
+        'method': "exhaustive",
+        'detection_time': (datetime.now() - start_time).total_seconds()
+    }
+
+
+# Rotate by angle degrees (counter-clockwise), growing the canvas so no corners are cut off
+def rotate_image(img, angle):
+    rows, columns = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D(((columns - 1) / 2, (rows - 1) / 2), angle, 1.0)
+
+    cos = abs(matrix[0, 0])
+    sin = abs(matrix[0, 1])
+    new_columns = int(np.ceil(rows * sin + columns * cos))
+    new_rows = int(np.ceil(rows * cos + columns * sin))
+    matrix[0, 2] += (new_columns - columns) / 2
+    matrix[1, 2] += (new_rows - rows) / 2
+
+    return cv2.warpAffine(img, matrix, (new_columns, new_rows), flags=cv2.INTER_LINEAR)
+
+
+# Straighten image
+def skew_correction(img, exhaustive=False):
+    if exhaustive is True:
+        skew = estimate_skew_exhaustive(img)
+    else:
+        skew = estimate_skew(img)
+
+    print('Best angle: {} ({}, {:.3f}s)'.format(skew['angle'], skew['method'], skew['detection_time']))
 
     # correct skew
-    data = inter.rotate(img_g, best_angle, reshape=True, order=0)
+    data = rotate_image(img, skew['angle'])
 
     return data
 
 
 # Remove noise
-def noise_removal(image_file):
-    img = cv2.imread(image_file)
+def noise_removal(img):
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
     dst = cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 15)
 
     return dst
 
 
-# Binarise the image
-def adaptive_thresholding(image_file):
-    img = cv2.imread(image_file, 0)
+# Binarise the image. Returned as 3 channels so every OCR engine can take it
+def adaptive_thresholding(img):
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     new_img = cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11, 2)  # works better
 
-    return new_img
+    return cv2.cvtColor(new_img, cv2.COLOR_GRAY2BGR)
 
 
-# remove shadows
+# remove shadows: flatten each channel against its background (a dilated, median blurred copy) at full
+# resolution, then denoise. Kept as the reference for remove_shadows_fast
 def remove_shadows(image_file):
-    print("here2", image_file)
-    # convert PIL to OpenCV
-    pil_image = image_file.convert("RGB")
-    open_cv_image = np.array(pil_image)
-    img = open_cv_image[:, :, ::-1].copy()
+    img = Frame.of(image_file).bgr
 
     rgb_planes = cv2.split(img)
 
@@ -74,30 +175,95 @@ def remove_shadows(image_file):
     return result
 
 
+# Odd kernel size for a kernel of size pixels at full resolution on an image scaled by scale
+def scaled_kernel(size, scale):
+    return max(3, int(round(size * scale)) // 2 * 2 + 1)
+
+
+# Background (paper and shadow, without the text) of a grey plane, estimated on a copy whose longest side is
+# at most max_size and scaled back up. Shadows change slowly, so little is lost by working small
+def estimate_background(plane, max_size=512):
+    scale = min(1.0, max_size / max(plane.shape[:2]))
+    small = plane
+    if scale < 1.0:
+        small = cv2.resize(plane, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    size = scaled_kernel(7, scale)
+    small = cv2.dilate(small, np.ones((size, size), np.uint8))
+    small = cv2.medianBlur(small, scaled_kernel(21, scale))
+
+    if scale < 1.0:
+        return cv2.resize(small, (plane.shape[1], plane.shape[0]), interpolation=cv2.INTER_LINEAR)
+    return small
+
+
+# Fast remove_shadows: the background is estimated at low resolution and, unless colour is True, only on the
+# luminance, whose flattened values are put back with the original chroma. denoise is True, False or "auto",
+# which only denoises images of up to denoise_max_pixels, where it is cheap enough to be worth it
+def remove_shadows_fast(image_file, max_size=512, colour=False, denoise="auto", denoise_max_pixels=2_000_000):
+    img = Frame.of(image_file).bgr
+    if denoise == "auto":
+        denoise = img.shape[0] * img.shape[1] <= denoise_max_pixels
+
+    if colour is True:
+        planes = [255 - cv2.absdiff(plane, estimate_background(plane, max_size)) for plane in cv2.split(img)]
+        result = cv2.merge(planes)
+        if denoise is True:
+            result = cv2.fastNlMeansDenoisingColored(result, None, 1, 10, 7, 15)
+
+        return result
+
+    luminance, red, blue = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb))
+    luminance = 255 - cv2.absdiff(luminance, estimate_background(luminance, max_size))
+    if denoise is True:
+        luminance = cv2.fastNlMeansDenoising(luminance, None, 1, 7, 15)
+
+    return cv2.cvtColor(cv2.merge([luminance, red, blue]), cv2.COLOR_YCrCb2BGR)
+
+
+# Shadow removal by mode name, e.g. for SHADOW_REMOVAL
+SHADOW_REMOVAL = {
+    "fast": remove_shadows_fast,
+    "full": remove_shadows,
+    "none": lambda image_file: Frame.of(image_file).bgr,
+}
+
+
+# Pre-processing stages by name
+STAGES = {
+    "skew_correction": skew_correction,
+    "noise_removal": noise_removal,
+    "thresholding": adaptive_thresholding,
+}
+
+
+# Run a declared list of stages over an image, passing arrays from one stage to the next
+class PreProcessingPipeline:
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+        for stage in self.stages:
+            if stage not in STAGES:
+                raise ValueError("Unknown pre-processing stage: {}".format(stage))
+
+    # Build a pipeline from the endpoint flags. Straighten first, then denoise, then binarise
+    @classmethod
+    def from_flags(cls, thresholding, skew, noise):
+        flags = {"skew_correction": skew, "noise_removal": noise, "thresholding": thresholding}
+        return cls([stage for stage in STAGES if flags[stage] is True])
+
+    # image_file is a Frame, a PIL image or an array. Arrays go to the first stage as they are
+    def run(self, image_file):
+        img = image_file if isinstance(image_file, np.ndarray) else Frame.of(image_file).bgr
+
+        for stage in self.stages:
+            img = STAGES[stage](img)
+
+        return img
+
+
 # Create a new pre-processed image based on user input
 def pre_process_image(image_file, thresholding, skew, noise):
-    # convert PIL to OpenCV
-    pil_image = image_file.convert("RGB")
-    open_cv_image = np.array(pil_image)
-    img = open_cv_image[:, :, ::-1].copy()
-    cv2.imwrite("tmp_img.jpg", img)
-
-    # Skew correction
-    if skew is True:
-        new_img = skew_correction("tmp_img.jpg")
-        cv2.imwrite("tmp_img.jpg", new_img)
-
-    # Adaptive thresholding
-    elif thresholding is True:
-        new_img = adaptive_thresholding("tmp_img.jpg")
-        cv2.imwrite("tmp_img.jpg", new_img)
-        new_img = cv2.imread("tmp_img.jpg")
-
-    # Noise removal
-    elif noise is True:
-        new_img = noise_removal("tmp_img.jpg")
-
-    else:
-        return cv2.imread("tmp_img.jpg")
+    pipeline = PreProcessingPipeline.from_flags(thresholding, skew, noise)
 
-    return new_img
+    return pipeline.run(image_file)
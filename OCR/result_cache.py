@@ -0,0 +1,150 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Key for a result: hash of the uploaded bytes plus the endpoint, the parameters that change its output and the
+# deployment settings (config) that do, so results from a differently configured engine are never served
+def cache_key(endpoint, contents, params=None, config=None):
+    digest = hashlib.sha256(contents).hexdigest()
+    params = json.dumps(params or {}, sort_keys=True)
+    config = json.dumps(config or {}, sort_keys=True)
+
+    return hashlib.sha256("{}|{}|{}|{}".format(endpoint, digest, params, config).encode()).hexdigest()
+
+
+# Least recently used results in memory, each kept for at most ttl seconds
+class MemoryTier:
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+
+        stored_at, results = self.entries[key]
+        if time.time() - stored_at > self.ttl:
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return results
+
+    def put(self, key, results):
+        self.entries[key] = (time.time(), results)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+# Results as JSON files in a directory so they survive restarts. Files older than ttl seconds are ignored and
+# the oldest files are removed once the directory grows past max_mb
+class DiskTier:
+    def __init__(self, directory, max_mb=512, ttl=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, results):
+        try:
+            data = json.dumps(results)
+        except (TypeError, ValueError):
+            return  # not JSON serialisable, keep it in memory only
+
+        tmp_path = self.path(key) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(key))
+
+        self.evict()
+
+    def evict(self):
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(".json"))
+
+
+# Two tier result cache: memory first, then disk (if a directory is given)
+class ResultCache:
+    def __init__(self, max_entries=256, ttl=3600, directory=None, disk_max_mb=512, disk_ttl=7 * 24 * 3600):
+        self.memory = MemoryTier(max_entries, ttl)
+        self.disk = DiskTier(directory, disk_max_mb, disk_ttl) if directory else None
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Returns a copy of the cached results, or None
+    def get(self, key):
+        with self.lock:
+            results = self.memory.get(key)
+            if results is not None:
+                self.hits['memory'] += 1
+                return copy.deepcopy(results)
+
+            if self.disk is not None:
+                results = self.disk.get(key)
+                if results is not None:
+                    self.hits['disk'] += 1
+                    self.memory.put(key, results)
+                    return copy.deepcopy(results)
+
+            self.misses += 1
+            return None
+
+    def put(self, key, results):
+        results = copy.deepcopy(results)
+
+        with self.lock:
+            self.memory.put(key, results)
+            if self.disk is not None:
+                self.disk.put(key, results)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'memory_entries': len(self.memory.entries),
+                'memory_max_entries': self.memory.max_entries,
+                'disk_enabled': self.disk is not None,
+                'disk_mb': round(self.disk.size() / (1024 * 1024), 2) if self.disk is not None else 0,
+                'hits': dict(self.hits),
+                'misses': self.misses,
+            }
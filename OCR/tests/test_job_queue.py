@@ -0,0 +1,17 @@
+# Run from the OCR directory: python -m pytest tests
+from job_queue import JobQueue
+
+
+# Opening the queue again, as a worker process importing the service does, must leave running jobs alone
+def test_running_jobs_are_only_recovered_on_request(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path=path)
+    job_id = queue.submit("tesseract", {}, b"image", "scan.png")
+    assert queue.claim()["id"] == job_id
+
+    JobQueue(path=path)
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.claim() is None
+
+    assert JobQueue(path=path).recover_running() == 1
+    assert queue.get(job_id)["status"] == "queued"
@@ -0,0 +1,20 @@
+# Run from the OCR directory: python -m pytest tests
+from ocr.layout import reading_order
+
+
+# A receipt style row of keys and values with a wide gap between them
+def key_value_rows():
+    boxes = [[40, 100, 120, 128], [600, 100, 690, 128], [40, 140, 100, 168], [600, 140, 670, 168]]
+    return boxes, ["Total", "42.00", "Tax", "8.00"]
+
+
+def test_key_value_rows_stay_on_their_lines():
+    boxes, texts = key_value_rows()
+
+    assert reading_order(boxes, texts)['text'] == "Total 42.00\nTax 8.00"
+
+
+def test_columns_are_split_when_asked():
+    boxes, texts = key_value_rows()
+
+    assert reading_order(boxes, texts, split_columns=True)['text'] == "Total\nTax\n42.00\n8.00"
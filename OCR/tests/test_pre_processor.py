@@ -0,0 +1,32 @@
+# Run from the OCR directory: python -m pytest tests
+import cv2
+import pytest
+
+import pre_processor
+from benchmarks.synthetic import synthetic_document
+
+
+def small_page(angle):
+    img = synthetic_document(angle=angle, shadow=False)
+    img = cv2.resize(img, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA)
+
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+# The coarse-to-fine estimate finds the same angle as the original exhaustive search, to within its fine step
+@pytest.mark.parametrize("angle", [2, -3, 5, -7])
+def test_skew_estimators_agree(angle):
+    gray = small_page(angle)
+    exhaustive = pre_processor.estimate_skew_exhaustive(gray, limit=45)['angle']
+    coarse_to_fine = pre_processor.estimate_skew(gray, limit=45)['angle']
+
+    assert exhaustive == -angle
+    assert abs(coarse_to_fine - exhaustive) <= 0.1
+
+
+# A straight page is left alone rather than turned upside down by either estimate
+def test_straight_page_over_the_full_range():
+    gray = small_page(0)
+
+    assert pre_processor.estimate_skew_exhaustive(gray)['angle'] == 0
+    assert pre_processor.estimate_skew(gray)['angle'] == 0
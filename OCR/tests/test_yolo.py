@@ -0,0 +1,55 @@
+# Run from the OCR directory: python -m pytest tests
+import numpy as np
+import pytest
+
+from ocr.yolo import YoloDetector, make_blob, onnx_batch_size, filter_detections
+
+
+# A box whose confidence is under class_threshold is still kept when it passes confidence_threshold
+def test_confidence_threshold_below_class_threshold():
+    detections = np.zeros((1, 10, 6), dtype=np.float32)
+    detections[0, 0] = [50, 50, 20, 10, 0.2, 0.9]
+    detections[0, 1] = [200, 50, 20, 10, 0.05, 0.9]
+
+    boxes, confidences, index = filter_detections(detections, [1.0], confidence_threshold=0.1,
+                                                  class_threshold=0.25)[0]
+
+    assert [boxes[n] for n in index] == [[40, 45, 20, 10]]
+    assert confidences[index[0]] == pytest.approx(0.2)
+
+
+# A stand-in for a static batch-1 detector export: the mean of each colour channel, reshaped with a fixed
+# batch of 1 the way exported YOLO heads are, so a larger batch cannot go through it in one pass
+def write_batch_1_model(path, size=64):
+    onnx = pytest.importorskip("onnx")
+    from onnx import helper, TensorProto
+
+    nodes = [
+        helper.make_node("GlobalAveragePool", ["images"], ["pooled"]),
+        helper.make_node("Reshape", ["pooled", "shape"], ["output0"]),
+    ]
+    shape = helper.make_tensor("shape", TensorProto.INT64, [3], [1, 1, 3])
+    graph = helper.make_graph(nodes, "batch_1", [helper.make_tensor_value_info("images", TensorProto.FLOAT,
+                                                                               [1, 3, size, size])],
+                              [helper.make_tensor_value_info("output0", TensorProto.FLOAT, [1, 1, 3])], [shape])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def test_batch_1_model_with_three_images(tmp_path):
+    path = str(tmp_path / "batch_1.onnx")
+    write_batch_1_model(path)
+    assert onnx_batch_size(path) == 1
+
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (48, 64, 3), dtype=np.uint8) for _ in range(3)]
+    input_images, blob, factors = make_blob(images, 64)
+
+    detector = YoloDetector(path, "opencv")
+    output = YoloDetector.forward(detector, blob)
+
+    assert output.shape == (3, 1, 3)
+    for n in range(3):
+        np.testing.assert_allclose(output[n], YoloDetector.forward(detector, blob[n:n + 1])[0], rtol=1e-5)
+        np.testing.assert_allclose(output[n, 0], blob[n].mean(axis=(1, 2)), rtol=1e-4)